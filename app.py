@@ -1,18 +1,51 @@
+import time
 import streamlit as st
 from dotenv import load_dotenv
 from modules import params
-from modules.knowledge_base import get_base, parse_retrieved, parse_description
-from modules.plots import plot_scores
+from modules.knowledge_base import get_base, parse_description
+from modules.artifact import get_artifact
+from modules.filters import FilterIndex, FilteredKnowledgeBase
+from modules.embeddings import load_model
+from modules.registry import shared
+from modules.query_cache import CachedKnowledgeBase
+from modules.metrics import METRICS, metrics_panel, serve
+from modules.warmup import Warmup
 
+RUN_START = time.perf_counter()
 load_dotenv()
 
 ## --- SESSION STATES --- ##
-if "base" not in st.session_state:
-    with st.spinner("Creazione della Knowledge Base..."):
-        st.session_state.base = get_base(
-            path="data/ateco_2025_leaf.csv",
-            model_id="BAAI/bge-m3"
-        )
+KB_PATH = "data/ateco_2025_leaf.csv"
+KB_MODEL_ID = "BAAI/bge-m3"
+
+
+def warm_up(progress):
+    progress(0.05, "Creazione della Knowledge Base...")
+    handle = shared(
+        ("kb", KB_PATH, KB_MODEL_ID),
+        lambda: CachedKnowledgeBase(get_base(path=KB_PATH, model_id=KB_MODEL_ID))
+    )
+    base = FilteredKnowledgeBase(handle.value, FilterIndex.from_artifact(get_artifact(KB_PATH)))
+    progress(0.5, "Caricamento del modello...")
+    load_model(KB_MODEL_ID)
+    progress(1.0, "Pronto.")
+    return handle, base
+
+
+# the knowledge base and the encoder load in the background; the page renders
+# right away and only a query submitted before they are ready waits for them
+if "warmup" not in st.session_state:
+    st.session_state.warmup = shared(("kb-warmup", KB_PATH, KB_MODEL_ID), lambda: Warmup(warm_up))
+warmup = st.session_state.warmup.value
+serve()
+
+
+@st.fragment(run_every=0.5)
+def warmup_status():
+    if warmup.done:
+        st.rerun()
+    st.progress(warmup.fraction, text=warmup.message)
+
 
 if "messages" not in st.session_state:
     st.session_state.messages = []
@@ -22,15 +55,19 @@ if "activity" not in st.session_state:
     st.session_state.activity = None
 
 ## --- APP --- ##
+if not warmup.done:
+    warmup_status()
+
 if prompt := st.text_input("Attività svolta.", placeholder=params.DESCRIPTIONS["chat_placeholder"]):
-    results = st.session_state.base.search(prompt, top_k=5)
-    result_df = parse_retrieved(results)
+    with st.spinner(warmup.message if not warmup.done else ""):
+        from modules.plots import plot_scores
 
-    with st.spinner():
-        results = st.session_state.base.search(prompt, top_k=5)
-        result_df = parse_retrieved(results)
+        _, base = warmup.result()
+        METRICS.register("kb_cache", base.stats)
+        result_df = base.search_codes(prompt, top_k=5)[0]
         activities = result_df["activity"].unique()
-        filtered_result = result_df[result_df["activity"]==st.session_state.activity] if st.session_state.activity else result_df
+        # the filter is applied before ranking, so the chosen activity still gets 5 candidates
+        filtered_result = base.search_codes(prompt, top_k=5, where={"activity": st.session_state.activity})[0] if st.session_state.activity else result_df
         fig = plot_scores(filtered_result, 50)
         st.markdown(params.DESCRIPTIONS["init_message"])
 
@@ -43,3 +80,6 @@ if prompt := st.text_input("Attività svolta.", placeholder=params.DESCRIPTIONS[
 
         with st.expander("Dettagli", expanded=False):
             st.plotly_chart(fig, use_container_width=True, theme="streamlit")
+
+metrics_panel()
+METRICS.observe_time("script_run", time.perf_counter() - RUN_START)
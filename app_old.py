@@ -1,7 +1,15 @@
+import queue
 import streamlit as st
-import numpy as np
-from modules.rag import Llama, build_kb, build_multivector_kb
-from modules.plots import plot_scores
+from uuid import uuid4
+from modules.rag import Llama
+from modules.knowledge_base import get_base
+from modules.embeddings import load_model
+from modules.registry import shared
+from modules.query_cache import CachedKnowledgeBase
+from modules.session import RetrievalSession
+from modules.generation import GenerationScheduler
+from modules.metrics import METRICS, metrics_panel, serve
+from modules.warmup import Warmup
 from modules import params
 
 st.title("👷🏻‍♀️👨🏻‍🌾 ATECO 2025")
@@ -13,21 +21,52 @@ st.set_page_config(
 )
 st.markdown("Cerca il codice ATECO della tua attività tramite linguaggio naturale.")
 
-if "kb" not in st.session_state:
-    with st.spinner("Creazione della Knowledge Base..."):
-        st.session_state.kb = build_kb(
-            path="data/ateco_2025_leaf.csv",
-            model_id="BAAI/bge-m3"
-        )
+KB_PATH = "data/ateco_2025_leaf.csv"
+KB_MODEL_ID = "BAAI/bge-m3"
+
+
+def warm_up(progress):
+    progress(0.05, "Creazione della Knowledge Base...")
+    kb = shared(
+        ("kb", KB_PATH, KB_MODEL_ID),
+        lambda: CachedKnowledgeBase(get_base(path=KB_PATH, model_id=KB_MODEL_ID))
+    )
+    load_model(KB_MODEL_ID)
+    progress(0.3, "Caricamento del modello...")
+    llm = shared(
+        ("llm", params.LLM["model_id"]),
+        lambda: GenerationScheduler(Llama(model_id=params.LLM["model_id"]), ttft_target=params.LLM["ttft_target"])
+    )
+    progress(1.0, "Pronto.")
+    return {"kb": kb, "llm": llm}
+
+
+# knowledge base, encoder and LLM load in the background while the chat renders
+if "warmup" not in st.session_state:
+    st.session_state.warmup = shared(("chat-warmup", KB_PATH, KB_MODEL_ID, params.LLM["model_id"]), lambda: Warmup(warm_up))
+warmup = st.session_state.warmup.value
+serve()
+
+
+@st.fragment(run_every=0.5)
+def warmup_status():
+    if warmup.done:
+        st.rerun()
+    st.progress(warmup.fraction, text=warmup.message)
+
+
+if not warmup.done:
+    warmup_status()
+
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
 if "history" not in st.session_state:
     st.session_state.history = []
 
-if "llm" not in st.session_state:
-    with st.spinner("Caricamento del modello..."):
-        st.session_state.llm = Llama(model_id="meta-llama/Llama-3.2-3B-Instruct")
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid4().hex
+
 
 for message in st.session_state.messages:
     with st.chat_message(message["role"], avatar=message["avatar"] if "avatar" in message else None):
@@ -35,21 +74,20 @@ for message in st.session_state.messages:
 
 if prompt := st.chat_input("Descrivi la tua attività. Ad esempio: \"Produzione di vini\" o \"Attività di scenografi\"."):
     st.chat_message("user").markdown(prompt)
-   
-    prompt_list = [m["content"] for m in st.session_state.messages if m["role"] == "user"] if st.session_state.messages else []
-    prompt_list.append(prompt)
-    
-    all_prompts = ". ".join(prompt_list)
-    results = st.session_state.kb.search(all_prompts, top_k=5)
-    mrkwn = []
-    for result in results:
-        codes = [r.metadata["code"] for r in result]
-        names = [r.metadata["title"] for r in result]
-        descs = [r.metadata["description"] for r in result]
-        scores = [r.score for r in result]
-        mrkwn = [f"**{c}**: {n}" for c, n, d in zip(np.unique(codes), np.unique(names), np.unique(descs))]
-    
-    candidates = '\n\n'.join(mrkwn)
+    from modules.plots import plot_scores
+
+    with st.spinner(warmup.message or "Caricamento..."):
+        loaded = warmup.result()
+    kb, llm = loaded["kb"].value, loaded["llm"].value
+    METRICS.register("kb_cache", kb.stats)
+    METRICS.register("kv_cache", llm.llm.prefix_cache.stats)
+    METRICS.register("llm", llm.throughput)
+    if "retrieval" not in st.session_state:
+        st.session_state.retrieval = RetrievalSession(kb)
+
+    # five distinct codes in rank order, from the chunks of the multi-vector corpus
+    ranked = st.session_state.retrieval.search_codes(prompt, top_k=5, search_k=50)
+    candidates = '\n\n'.join(f"**{c}**: {n}" for c, n in zip(ranked["code"], ranked["title"]))
     parsed_prompt = params.LLM["instruction_template"].format(description=prompt, candidates=candidates)
     st.session_state.messages.append({"role": "user", "content": prompt})
     st.session_state.history.append({"role": "user", "content": parsed_prompt})
@@ -58,22 +96,36 @@ if prompt := st.chat_input("Descrivi la tua attività. Ad esempio: \"Produzione
         if st.button("Cancella cronologia"):
             st.session_state.messages = []
             st.session_state.history = []
+            st.session_state.retrieval.reset()
+            llm.llm.prefix_cache.drop(st.session_state.session_id)
             st.success("Cronologia cancellata.")
 
         st.write("### Cronologia")
         st.plotly_chart(
             plot_scores(
-                codes=[r.metadata["code"] for r in results[0]],
-                texts=[r.metadata["title"] for r in results[0]],
-                scores=[r.score for r in results[0]]
+                codes=ranked["code"].tolist(),
+                texts=ranked["title"].tolist(),
+                scores=ranked["score"].tolist()
             ),
             use_container_width=True
         )
 
     with st.chat_message("assistant", avatar="resources/chatbot_ateco_logo.png"):
-        full_resp = st.write_stream(st.session_state.llm.stream_with_history(
-            system=params.LLM["system_prompt"], messages=st.session_state.history, max_new_tokens=512)
-        )
-        st.info("#### Candidati\n" + candidates)
-    st.session_state.messages.append({"role": "assistant", "content": full_resp, "avatar": "resources/chatbot_ateco_logo.png"})
-    st.session_state.history.append({"role": "assistant", "content": full_resp})
\ No newline at end of file
+        try:
+            full_resp = st.write_stream(llm.stream_with_history(
+                system=params.LLM["system_prompt"], messages=st.session_state.history, max_new_tokens=512,
+                session_id=st.session_state.session_id)
+            )
+        except queue.Full:
+            full_resp = None
+            # drop the turn, so the retry is not sent twice
+            st.session_state.messages.pop()
+            st.session_state.history.pop()
+            st.warning("Il modello è occupato, riprova tra qualche secondo.")
+        else:
+            st.info("#### Candidati\n" + candidates)
+    if full_resp is not None:
+        st.session_state.messages.append({"role": "assistant", "content": full_resp, "avatar": "resources/chatbot_ateco_logo.png"})
+        st.session_state.history.append({"role": "assistant", "content": full_resp})
+
+metrics_panel()
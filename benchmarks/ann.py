@@ -0,0 +1,49 @@
+"""Recall-vs-exact and latency of the IVF index for a range of n_probe.
+
+    python -m benchmarks.ann --n-lists 256 --probes 1 2 4 8 16 32 --scale 50
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from modules.ann import IVFIndex, sweep
+from modules.knowledge_base import get_base
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default="data/ateco_2025_leaf.csv")
+    parser.add_argument("--queries", default="data/ateco_2025_gold.csv")
+    parser.add_argument("--model-id", default="BAAI/bge-m3")
+    parser.add_argument("--n-lists", type=int, default=None)
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--scale", type=int, default=1, help="add noisy copies of the corpus to simulate a larger one")
+    parser.add_argument("--noise", type=float, default=0.05)
+    args = parser.parse_args()
+
+    base = get_base(args.path, args.model_id)
+    vectors = np.asarray(base.vectors, dtype=np.float32)
+    if args.scale > 1:
+        rng = np.random.default_rng(0)
+        copies = [vectors]
+        for _ in range(args.scale - 1):
+            noisy = vectors + rng.normal(0, args.noise, vectors.shape).astype(np.float32)
+            copies.append(noisy / np.linalg.norm(noisy, axis=1, keepdims=True))
+        vectors = np.concatenate(copies)
+
+    queries = base.encode(pd.read_csv(args.queries, dtype=str)["text"].dropna().tolist())
+
+    start = time.perf_counter()
+    index = IVFIndex.build(vectors, n_lists=args.n_lists)
+    build_s = time.perf_counter() - start
+
+    print(f"{len(vectors)} vectors, {index.n_lists} lists, built in {build_s:.1f} s, {len(queries)} queries, top-{args.top_k}")
+    print(f"{'n_probe':>8}{'recall':>9}{'p50 ms':>9}{'p95 ms':>9}{'scanned':>10}")
+    for row in sweep(index, vectors, queries, args.probes, args.top_k):
+        n_probe = "exact" if row["n_probe"] is None else row["n_probe"]
+        print(f"{n_probe:>8}{row['recall']:9.3f}{row['p50_ms']:9.2f}{row['p95_ms']:9.2f}{row['scanned']:10.0f}")
+
+
+if __name__ == "__main__":
+    main()
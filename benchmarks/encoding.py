@@ -0,0 +1,60 @@
+"""Scaling of sharded CPU encoding from 1 to N worker processes.
+
+    python -m benchmarks.encoding --model-id BAAI/bge-m3 --workers 1 2 4 8
+
+Encodes the leaf corpus texts once per worker count (pool start-up and
+model loads included, as in an index build) and reports throughput, speedup
+and parallel efficiency against one process, the largest difference from
+the single-process vectors, and the padding of the batches each worker
+encodes. `model.encode` already sorts its input by length, so the
+single-process row is the baseline for padding: sharding can only keep it
+from growing, not reduce it.
+"""
+import os
+import argparse
+import time
+import numpy as np
+from modules.artifact import get_artifact
+from modules.embeddings import encode, length_shards
+
+
+def padding_waste(lengths: np.ndarray, shards, batch_size: int) -> float:
+    """Share of padded characters when every shard is batched as
+    `model.encode` does it: longest texts first, `batch_size` at a time."""
+    padded = 0
+    for shard in shards:
+        ordered = shard[np.argsort(-lengths[shard], kind="stable")]
+        padded += sum(len(b) * lengths[b].max() for b in np.array_split(ordered, range(batch_size, len(ordered), batch_size)) if len(b))
+    return 1 - lengths.sum() / padded
+
+
+def main():
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default="data/ateco_2025_leaf.csv")
+    parser.add_argument("--model-id", default="BAAI/bge-m3")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, nargs="*", default=sorted({1, *[2 ** i for i in range(1, cores.bit_length())], cores}))
+    parser.add_argument("--limit", type=int, default=None, help="encode only the first N texts")
+    args = parser.parse_args()
+
+    texts = get_artifact(args.path).strings("leaf.text").tolist()[:args.limit]
+    lengths = np.array([len(t) for t in texts])
+    print(f"{len(texts)} texts on {cores} cores")
+
+    print(f"{'workers':>8}{'seconds':>10}{'texts/s':>10}{'speedup':>9}{'efficiency':>12}{'max |diff|':>12}{'padding':>9}")
+    reference, base_seconds = None, None
+    for workers in args.workers:
+        start = time.perf_counter()
+        vectors = encode(texts, args.model_id, args.batch_size, workers=workers)
+        seconds = time.perf_counter() - start
+        if reference is None:
+            reference, base_seconds = vectors, seconds
+        speedup = base_seconds / seconds
+        shards = length_shards(texts, workers, args.batch_size) if workers > 1 else [np.arange(len(texts))]
+        print(f"{workers:>8}{seconds:10.2f}{len(texts) / seconds:10.1f}{speedup:9.2f}{speedup / workers:12.1%}"
+              f"{float(np.abs(vectors - reference).max()):12.2e}{padding_waste(lengths, shards, args.batch_size):9.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Accuracy and speed of `get_base` / `search` / `parse_retrieved` on the gold set.
+
+Every embedding model of `params.MODELS` that runs locally is benchmarked in
+its own process (so peak RSS is per model) and the report is written as JSON;
+`--baseline` compares it with a stored report and exits with status 1 on an
+accuracy drop or latency increase beyond the tolerances.
+
+    python -m benchmarks.gold --output benchmarks/gold.json
+    python -m benchmarks.gold --output new.json --baseline benchmarks/gold.json
+"""
+import argparse
+import json
+import platform
+import resource
+import sys
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from modules import params
+from modules.knowledge_base import get_base, parse_retrieved, parse_retrieved_batch
+
+LEVELS_PATH = "classification/ateco_2025/ateco_2025_full.csv"
+# hierarchy level -> length of the code prefix ("sezione" goes through the division)
+LEVELS = {"sezione": 2, "divisione": 2, "gruppo": 4, "classe": 5, "categoria": 7}
+KS = (1, 5, 10)
+LOCAL_TYPES = ("huggingface",)
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def level_keys(codes: pd.Series, level: str, section_of: dict) -> pd.Series:
+    keys = codes.str[:LEVELS[level]]
+    return keys.map(section_of) if level == "sezione" else keys
+
+
+def accuracy(gold: pd.DataFrame, ranked: np.ndarray, section_of: dict) -> dict:
+    """accuracy@k per level; a gold code shorter than a level's prefix is not
+    scored at that level."""
+    report = {}
+    for level, length in LEVELS.items():
+        scored = (gold["code"].str.len() >= length).to_numpy()
+        truth = level_keys(gold["code"], level, section_of).to_numpy()
+        predicted = np.stack([
+            level_keys(pd.Series(column), level, section_of).to_numpy()
+            for column in ranked.T
+        ], axis=1)
+        hits = predicted == truth[:, None]
+        report[level] = {
+            f"acc@{k}": float(hits[scored, :k].any(axis=1).mean()) if scored.any() else None
+            for k in KS
+        }
+        report[level]["n"] = int(scored.sum())
+    return report
+
+
+def run(args: dict) -> dict:
+    model_id = args["model_id"]
+    gold = pd.read_csv(args["gold"], dtype=str).dropna(subset=["text"]).reset_index(drop=True)
+    levels = pd.read_csv(LEVELS_PATH, dtype=str)
+    divisions = levels[levels["level"] == "divisione"]
+    section_of = dict(zip(divisions["code"], divisions["main"]))
+    queries = gold["text"].tolist()
+    top_k = max(KS)
+
+    start = time.perf_counter()
+    base = get_base(args["path"], model_id, cache=args["cache"])
+    build_seconds = time.perf_counter() - start
+
+    base.search(queries[:1], top_k=args["search_k"])  # load the encoder outside the timings
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        parse_retrieved(base.search(query, top_k=args["search_k"]), base, top_k=top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    code_ids, _ = parse_retrieved_batch(base.search(queries, top_k=args["search_k"]), base, top_k=top_k)
+    batch_seconds = time.perf_counter() - start
+
+    code_of = np.append(base.code_table["code"].to_numpy(dtype=object), "")
+    ranked = code_of[np.pad(code_ids, ((0, 0), (0, top_k - code_ids.shape[1])), constant_values=-1)]
+
+    return {
+        "model_id": model_id,
+        "vectors": len(base),
+        "queries": len(queries),
+        "accuracy": accuracy(gold, ranked, section_of),
+        "latency_ms": {f"p{p}": float(np.percentile(latencies, p)) for p in (50, 95, 99)},
+        "throughput_qps": len(queries) / batch_seconds,
+        "build_seconds": build_seconds,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def compare(report: dict, baseline: dict, max_accuracy_drop: float, max_slowdown: float) -> list:
+    """Human-readable regressions of `report` with respect to `baseline`."""
+    regressions = []
+    for model_id, new in report["models"].items():
+        old = baseline["models"].get(model_id)
+        if old is None or "skipped" in new or "skipped" in old:
+            continue
+        for level, scores in new["accuracy"].items():
+            for metric, value in scores.items():
+                before = old["accuracy"].get(level, {}).get(metric)
+                if metric != "n" and value is not None and before is not None and before - value > max_accuracy_drop:
+                    regressions.append(f"{model_id} {level} {metric}: {before:.3f} -> {value:.3f}")
+        for metric, value in new["latency_ms"].items():
+            before = old["latency_ms"].get(metric)
+            if before and value > before * (1 + max_slowdown):
+                regressions.append(f"{model_id} latency {metric}: {before:.2f} -> {value:.2f} ms")
+        if old["throughput_qps"] and new["throughput_qps"] < old["throughput_qps"] / (1 + max_slowdown):
+            regressions.append(f"{model_id} throughput: {old['throughput_qps']:.1f} -> {new['throughput_qps']:.1f} q/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default="data/ateco_2025_leaf.csv")
+    parser.add_argument("--gold", default="data/ateco_2025_gold.csv")
+    parser.add_argument("--models", nargs="+", default=list(params.MODELS["embedding"]))
+    parser.add_argument("--search-k", type=int, default=50)
+    parser.add_argument("--no-cache", action="store_true", help="encode the corpus instead of loading cached vectors")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.01)
+    parser.add_argument("--max-slowdown", type=float, default=0.2)
+    args = parser.parse_args()
+
+    report = {
+        "config": {"path": args.path, "gold": args.gold, "search_k": args.search_k, "cache": not args.no_cache},
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "processor": platform.processor()},
+        "models": {},
+    }
+    for model_id in args.models:
+        spec = params.MODELS["embedding"].get(model_id, {"type": "huggingface"})
+        if spec["type"] not in LOCAL_TYPES:
+            report["models"][model_id] = {"skipped": f"{spec['type']} embeddings are not served by get_base"}
+            continue
+        # one process per model, so peak RSS is not inherited from the previous one
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            report["models"][model_id] = pool.submit(run, {
+                "model_id": model_id, "path": args.path, "gold": args.gold,
+                "search_k": args.search_k, "cache": not args.no_cache,
+            }).result()
+
+        result = report["models"][model_id]
+        print(f"{model_id}: acc@1/5/10 (classe) "
+              + "/".join(f"{result['accuracy']['classe'][f'acc@{k}']:.3f}" for k in KS)
+              + f", p50 {result['latency_ms']['p50']:.1f} ms, p95 {result['latency_ms']['p95']:.1f} ms"
+              + f", {result['throughput_qps']:.1f} q/s, build {result['build_seconds']:.1f} s, {result['peak_rss_mb']:.0f} MB")
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.max_accuracy_drop, args.max_slowdown)
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Latency and recall@k of hierarchical search against flat search.
+
+    python -m benchmarks.hierarchical --beams 2,4 4,8 8,16 --top-k 10
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from modules.knowledge_base import get_base, aggregate_codes
+from modules.hierarchy import get_hierarchical_base
+
+
+def top_codes(base, idx, scores, top_k):
+    code_ids, _ = aggregate_codes(base.code_ids[np.maximum(idx, 0)], np.where(idx >= 0, scores, -np.inf), top_k=top_k)
+    return [set(row[row >= 0].tolist()) for row in code_ids]
+
+
+def timed(fn, vectors):
+    latencies, out = [], []
+    for q in vectors:
+        start = time.perf_counter()
+        out.append(fn(q[None, :]))
+        latencies.append(time.perf_counter() - start)
+    idx = np.concatenate([o[0] for o in out])
+    scores = np.concatenate([o[1] for o in out])
+    return idx, scores, np.array(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default="data/ateco_2025_leaf.csv")
+    parser.add_argument("--gold", default="data/ateco_2025_gold.csv")
+    parser.add_argument("--model-id", default="BAAI/bge-m3")
+    parser.add_argument("--levels", default="sezione,divisione")
+    parser.add_argument("--beams", nargs="+", default=["2,4", "4,8", "8,16"])
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--search-k", type=int, default=50)
+    args = parser.parse_args()
+
+    base = get_base(args.path, args.model_id)
+    tree = get_hierarchical_base(base, levels=tuple(args.levels.split(",")))
+
+    gold = pd.read_csv(args.gold, dtype=str).dropna(subset=["text"])
+    vectors = base.encode(gold["text"].tolist())
+    gold_class = gold["code"].str[:5].tolist()
+
+    idx, scores, flat_ms = timed(lambda q: base.search_vectors(q, args.search_k), vectors)
+    flat = top_codes(base, idx, scores, args.top_k)
+    code_of = base.code_table["code"].to_numpy()
+
+    def accuracy(ranked):
+        return np.mean([any(code_of[c][:5] == g for c in r) for r, g in zip(ranked, gold_class)])
+
+    print(f"{len(base)} vectors, {len(gold)} queries, top-{args.top_k} codes")
+    print(f"{'mode':<14}{'p50 ms':>9}{'p95 ms':>9}{'vectors':>10}{'recall@k':>10}{'acc@k':>8}")
+    print(f"{'flat':<14}{np.percentile(flat_ms, 50):9.2f}{np.percentile(flat_ms, 95):9.2f}{len(base):10d}{1.0:10.3f}{accuracy(flat):8.3f}")
+
+    for beam in args.beams:
+        beams = tuple(int(b) for b in beam.split(","))
+        idx, scores, ms = timed(lambda q: tree.search_vectors(q, args.search_k, beams), vectors)
+        ranked = top_codes(base, idx, scores, args.top_k)
+        recall = np.mean([len(h & f) / max(len(f), 1) for h, f in zip(ranked, flat)])
+        scanned = np.mean([len(tree.leaf_rows(tree.route(q, beams))) for q in vectors])
+        print(f"{'beam ' + beam:<14}{np.percentile(ms, 50):9.2f}{np.percentile(ms, 95):9.2f}{scanned:10.0f}{recall:10.3f}{accuracy(ranked):8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Memory saved and recall@k lost by quantized vector storage on the gold set.
+
+    python -m benchmarks.quantization --model-id BAAI/bge-m3 --top-k 10
+
+Memory is the resident set of a fresh process that loads the base, swaps in
+the quantized index as `get_base` does and answers the gold queries, so it
+counts the float32 pages that rescoring (or a flat scan) actually touches,
+not just the size of the stored codes.
+"""
+import os
+import gc
+import argparse
+import time
+import multiprocessing
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from modules.knowledge_base import get_base, aggregate_codes, remap_vectors
+from modules.quantization import quantize
+
+
+def ranked_codes(base, idx, scores, top_k):
+    code_ids, _ = aggregate_codes(base.code_ids[idx], scores, top_k=top_k)
+    return [row[row >= 0] for row in code_ids]
+
+
+def rss_mib() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def serving_rss(path: str, model_id: str, queries: np.ndarray, search_k: int, method: str = None, rescore: int = 0, kwargs: dict = None) -> float:
+    base = get_base(path, model_id)
+    if method is not None:
+        base.index = quantize(base.vectors, method, rescore=rescore, **(kwargs or {}))
+        base.vectors = remap_vectors(base.vectors)
+        gc.collect()
+    base.search_vectors(queries, search_k)
+    return rss_mib()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default="data/ateco_2025_leaf.csv")
+    parser.add_argument("--gold", default="data/ateco_2025_gold.csv")
+    parser.add_argument("--model-id", default="BAAI/bge-m3")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--search-k", type=int, default=50)
+    parser.add_argument("--pq-subspaces", type=int, default=64)
+    args = parser.parse_args()
+
+    base = get_base(args.path, args.model_id)
+    vectors = np.asarray(base.vectors, dtype=np.float32)
+    gold = pd.read_csv(args.gold, dtype=str).dropna(subset=["text"])
+    queries = base.encode(gold["text"].tolist())
+    gold_class = gold["code"].str[:5].to_numpy()
+    code_of = base.code_table["code"].to_numpy()
+
+    start = time.perf_counter()
+    exact = ranked_codes(base, *base.search_vectors(queries, args.search_k), args.top_k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    def accuracy(ranked):
+        return np.mean([np.isin(gold_class[i], [c[:5] for c in code_of[r]]) for i, r in enumerate(ranked)])
+
+    def rss(*config) -> float:
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            return pool.submit(serving_rss, args.path, args.model_id, queries, args.search_k, *config).result()
+
+    flat_rss = rss()
+    print(f"{len(vectors)} x {vectors.shape[1]} vectors, {len(queries)} gold queries, top-{args.top_k} codes")
+    print(f"{'storage':<18}{'index MB':>10}{'RSS MB':>9}{'saved':>8}{'recall@k':>10}{'acc@k':>8}{'ms/query':>10}")
+    print(f"{'float32':<18}{vectors.nbytes / 2**20:10.2f}{flat_rss:9.1f}{'-':>8}{1.0:10.3f}{accuracy(exact):8.3f}{exact_ms:10.3f}")
+
+    configs = [("float16", {}), ("int8", {}), ("pq", {"n_subspaces": args.pq_subspaces})]
+    for method, kwargs in configs:
+        for rescore in (0, 4):
+            index = quantize(vectors, method, rescore=rescore, **kwargs)
+            start = time.perf_counter()
+            idx, scores = index.search(base.vectors, queries, args.search_k)
+            ms = (time.perf_counter() - start) * 1000 / len(queries)
+            ranked = ranked_codes(base, idx, scores, args.top_k)
+            recall = np.mean([len(np.intersect1d(r, e)) / max(len(e), 1) for r, e in zip(ranked, exact)])
+            label = f"{method}" + (f" +rescore{rescore}" if rescore else "")
+            method_rss = rss(method, rescore, kwargs)
+            print(f"{label:<18}{index.nbytes / 2**20:10.2f}{method_rss:9.1f}{1 - method_rss / flat_rss:8.1%}{recall:10.3f}{accuracy(ranked):8.3f}{ms:10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Time to first render of app.py with the background warm-up.
+
+Each measurement runs in a fresh interpreter:
+  - render: first script run of app.py under Streamlit's AppTest, then the
+    time until the warm-up is ready and the latency of the first query;
+  - blocking: what the first render used to wait for (knowledge base and
+    encoder built before the page is drawn);
+  - imports: import time of the modules the apps load at startup.
+
+    python -m benchmarks.startup --repeat 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+
+IMPORTS = ("modules.rag", "modules.knowledge_base", "modules.plots", "streamlit")
+
+
+def measure_render(query: str) -> dict:
+    from streamlit.testing.v1 import AppTest
+
+    start = time.perf_counter()
+    at = AppTest.from_file(os.path.abspath("app.py"), default_timeout=600)
+    at.run()
+    first_render = time.perf_counter() - start
+
+    warmup = at.session_state["warmup"].value
+    warmup.ready.wait()
+    ready = time.perf_counter() - start
+
+    query_start = time.perf_counter()
+    at.text_input[0].input(query).run()
+    return {"first_render": first_render, "ready": ready, "first_query": time.perf_counter() - query_start}
+
+
+def measure(kind: str, query: str) -> dict:
+    if kind == "render":
+        return measure_render(query)
+
+    if kind == "blocking":
+        start = time.perf_counter()
+        from modules.embeddings import load_model
+        from modules.knowledge_base import get_base
+        from modules.query_cache import CachedKnowledgeBase
+
+        base = CachedKnowledgeBase(get_base(path="data/ateco_2025_leaf.csv", model_id="BAAI/bge-m3"))
+        load_model("BAAI/bge-m3")
+        first_render = time.perf_counter() - start
+        query_start = time.perf_counter()
+        base.search(query, top_k=5)
+        return {"first_render": first_render, "ready": first_render, "first_query": time.perf_counter() - query_start}
+
+    module = kind.split(":", 1)[1]
+    start = time.perf_counter()
+    __import__(module)
+    return {"import": time.perf_counter() - start}
+
+
+def run_child(kind: str, query: str) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child", kind, "--query", query],
+        check=True, capture_output=True, text=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--query", default="produzione di vini")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.query)))
+        return
+
+    print(f"{'startup':<12}{'first render s':>16}{'ready s':>10}{'first query s':>15}")
+    for kind in ("blocking", "render"):
+        runs = [run_child(kind, args.query) for _ in range(args.repeat)]
+        median = {key: float(np.median([r[key] for r in runs])) for key in runs[0]}
+        print(f"{kind:<12}{median['first_render']:16.3f}{median['ready']:10.3f}{median['first_query']:15.3f}")
+
+    print(f"\n{'module':<26}{'import s':>10}")
+    for module in IMPORTS:
+        runs = [run_child(f"import:{module}", args.query)["import"] for _ in range(args.repeat)]
+        print(f"{module:<26}{np.median(runs):10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import os
+import time
+import numpy as np
+from typing import List
+
+
+def kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = 10, seed: int = 0, batch: int = 65_536) -> np.ndarray:
+    """Spherical k-means on L2-normalized vectors, assigning in bounded batches."""
+    rng = np.random.default_rng(seed)
+    centroids = np.array(vectors[rng.choice(len(vectors), n_clusters, replace=False)], dtype=np.float32)
+
+    for _ in range(iterations):
+        sums = np.zeros_like(centroids)
+        counts = np.zeros(n_clusters, dtype=np.int64)
+        for start in range(0, len(vectors), batch):
+            chunk = np.asarray(vectors[start:start + batch], dtype=np.float32)
+            labels = np.argmax(chunk @ centroids.T, axis=1)
+            np.add.at(sums, labels, chunk)
+            counts += np.bincount(labels, minlength=n_clusters)
+
+        empty = counts == 0
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """Inverted-file index: vectors are bucketed by their nearest centroid and
+    a query is scored exactly against the `n_probe` closest buckets only."""
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray, fingerprint: str = "", n_probe: int = 8):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.fingerprint = fingerprint
+        self.n_probe = n_probe
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, n_lists: int = None, iterations: int = 10, seed: int = 0, fingerprint: str = "", batch: int = 65_536) -> "IVFIndex":
+        n_lists = n_lists or max(1, int(np.sqrt(len(vectors))))
+        centroids = kmeans(vectors, n_lists, iterations, seed, batch)
+
+        labels = np.concatenate([
+            np.argmax(np.asarray(vectors[start:start + batch], dtype=np.float32) @ centroids.T, axis=1)
+            for start in range(0, len(vectors), batch)
+        ])
+        order = np.argsort(labels, kind="stable").astype(np.int64)
+        offsets = np.searchsorted(labels[order], np.arange(n_lists + 1)).astype(np.int64)
+        return cls(centroids, order, offsets, fingerprint)
+
+    def save(self, path: str):
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, centroids=self.centroids, order=self.order, offsets=self.offsets, fingerprint=np.array(self.fingerprint))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, n_probe: int = 8) -> "IVFIndex":
+        with np.load(path) as data:
+            return cls(data["centroids"], data["order"], data["offsets"], str(data["fingerprint"]), n_probe)
+
+    def candidates(self, query_vector: np.ndarray, n_probe: int) -> np.ndarray:
+        probe = np.argpartition(-(self.centroids @ query_vector), min(n_probe, self.n_lists) - 1)[:n_probe]
+        return np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probe])
+
+    def search(self, vectors: np.ndarray, query_vectors: np.ndarray, top_k: int = 5, n_probe: int = None):
+        n_probe = n_probe or self.n_probe
+        n = len(query_vectors)
+        idx = np.zeros((n, top_k), dtype=np.int64)
+        scores = np.full((n, top_k), -np.inf, dtype=np.float32)
+
+        for i, q in enumerate(query_vectors):
+            rows = self.candidates(q, n_probe)
+            row_scores = vectors[rows] @ q
+            k = min(top_k, len(rows))
+            if k == 0:
+                continue
+            best = np.argpartition(-row_scores, k - 1)[:k]
+            best = best[np.argsort(-row_scores[best], kind="stable")]
+            idx[i, :k] = rows[best]
+            scores[i, :k] = row_scores[best]
+
+        return idx, scores
+
+
+def sweep(index: IVFIndex, vectors: np.ndarray, query_vectors: np.ndarray, probes: List[int], top_k: int = 10) -> List[dict]:
+    """Recall@k against exact search and per-query latency for each `n_probe`."""
+    exact_ms = []
+    exact = []
+    for q in query_vectors:
+        start = time.perf_counter()
+        scores = vectors @ q
+        exact.append(set(np.argpartition(-scores, top_k - 1)[:top_k].tolist()))
+        exact_ms.append((time.perf_counter() - start) * 1000)
+
+    report = [{"n_probe": None, "recall": 1.0, "p50_ms": float(np.percentile(exact_ms, 50)), "p95_ms": float(np.percentile(exact_ms, 95)), "scanned": len(vectors)}]
+    for n_probe in probes:
+        latencies, recalls, scanned = [], [], []
+        for q, truth in zip(query_vectors, exact):
+            start = time.perf_counter()
+            idx, _ = index.search(vectors, q[None, :], top_k, n_probe)
+            latencies.append((time.perf_counter() - start) * 1000)
+            recalls.append(len(truth & set(idx[0].tolist())) / top_k)
+            scanned.append(len(index.candidates(q, n_probe)))
+        report.append({
+            "n_probe": n_probe,
+            "recall": float(np.mean(recalls)),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "scanned": float(np.mean(scanned)),
+        })
+    return report
@@ -0,0 +1,328 @@
+"""Compiled ATECO 2025 classification artifact.
+
+    python -m modules.artifact data/ateco_2025_leaf.csv \\
+        --raw classification/ateco_2025/ateco_2025_raw.xlsx \\
+        --levels-dir classification/ateco_2025 --model-id BAAI/bge-m3
+
+One versioned binary file (`<leaf>.artifact`) holds everything the apps
+otherwise rebuild from CSV text on every start: the leaf corpus (embedding
+texts, their code ids and the per-code metadata), the split descriptors,
+the classification hierarchy parsed from the raw ISTAT workbook and,
+optionally, the corpus vectors of an embedding model. Arrays are stored
+uncompressed and 64-byte aligned after a JSON header, so `Artifact` opens
+them as read-only memory maps, and strings are one UTF-8 buffer plus
+offsets, decoded only when read.
+"""
+import os
+import json
+import time
+import struct
+import argparse
+import hashlib
+import numpy as np
+import pandas as pd
+from typing import Dict, List
+from modules.corpus import build_leaf_corpus, explode_descriptors
+from modules.embeddings import encode, model_slug, text_hash
+
+MAGIC = b"ATECOART"
+VERSION = 1
+ALIGN = 64
+PREAMBLE = struct.Struct("<8sIQ")  # magic, version, header length
+
+LEVEL_LABELS = {1: "sezione", 2: "divisione", 3: "gruppo", 4: "classe", 5: "categoria", 6: "sottocategoria"}
+CODE_COLUMNS = ("code", "title", "description", "activity")
+
+
+def file_hash(path: str) -> str:
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def artifact_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".artifact"
+
+
+class StringArray:
+    """Read-only sequence of strings stored as one UTF-8 buffer and the
+    (n + 1) offsets of its items."""
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    @staticmethod
+    def pack(strings) -> Dict[str, np.ndarray]:
+        encoded = [("" if s is None or s != s else str(s)).encode("utf-8") for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        return {"data": np.frombuffer(b"".join(encoded), dtype=np.uint8), "offsets": offsets}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if isinstance(i, (list, np.ndarray)):
+            return [self[j] for j in i]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.data[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        buffer = self.data.tobytes()
+        offsets = self.offsets.tolist()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield buffer[start:end].decode("utf-8")
+
+    def tolist(self) -> List[str]:
+        return list(self)
+
+
+def write_artifact(path: str, arrays: Dict[str, np.ndarray], strings: Dict[str, list], meta: dict):
+    for name, values in strings.items():
+        for part, array in StringArray.pack(values).items():
+            arrays[f"{name}.{part}"] = array
+
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+
+    header = json.dumps({"meta": meta, "arrays": layout, "strings": list(strings)}).encode("utf-8")
+    data_start = -(-(PREAMBLE.size + len(header)) // ALIGN) * ALIGN
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(PREAMBLE.pack(MAGIC, VERSION, len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp, path)
+
+
+class Artifact:
+    """Lazily memory-mapped view of an artifact file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, version, header_len = PREAMBLE.unpack(f.read(PREAMBLE.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a classification artifact")
+            if version != VERSION:
+                raise ValueError(f"{path} has artifact version {version}, expected {VERSION}")
+            header = json.loads(f.read(header_len))
+        self.meta = header["meta"]
+        self.layout = header["arrays"]
+        self.string_names = header["strings"]
+        self.data_start = -(-(PREAMBLE.size + header_len) // ALIGN) * ALIGN
+        self._arrays = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.layout or f"{name}.offsets" in self.layout
+
+    def array(self, name: str) -> np.ndarray:
+        if name not in self._arrays:
+            spec = self.layout[name]
+            shape = tuple(spec["shape"])
+            if int(np.prod(shape)) == 0:
+                self._arrays[name] = np.empty(shape, dtype=spec["dtype"])
+            else:
+                self._arrays[name] = np.memmap(self.path, dtype=spec["dtype"], mode="r", offset=self.data_start + spec["offset"], shape=shape)
+        return self._arrays[name]
+
+    def strings(self, name: str) -> StringArray:
+        return StringArray(self.array(f"{name}.data"), self.array(f"{name}.offsets"))
+
+    def frame(self, prefix: str, columns) -> pd.DataFrame:
+        return pd.DataFrame({c: self.strings(f"{prefix}.{c}").tolist() for c in columns})
+
+    def vectors(self, model_id: str) -> np.ndarray:
+        name = f"vectors.{model_slug(model_id)}"
+        return self.array(name) if name in self.layout else None
+
+
+def leaf_payload(leaf_path: str):
+    """Arrays and strings of the leaf corpus: one row per descriptor item."""
+    df = pd.read_csv(leaf_path)
+    corpus = build_leaf_corpus(df)
+    code_ids, _ = pd.factorize(corpus["code"])
+    codes = corpus.drop_duplicates("code").reset_index(drop=True)
+    items = explode_descriptors(df["descriptor"])
+
+    arrays = {
+        "leaf.code_id": code_ids.astype(np.int32),
+        "descriptors.code_id": pd.Index(codes["code"]).get_indexer(df["code"].values[items.index]).astype(np.int32),
+    }
+    strings = {
+        "leaf.text": corpus["text"].tolist(),
+        "descriptors.item": items.tolist(),
+        **{f"codes.{c}": codes[c].tolist() for c in CODE_COLUMNS},
+        "codes.hierarchy": df.drop_duplicates("code").set_index("code")["hierarchy"].reindex(codes["code"]).tolist(),
+    }
+    return arrays, strings
+
+
+def load_raw(path: str) -> pd.DataFrame:
+    """The ISTAT workbook with its section (`main`) carried down and the empty
+    level-2 notes filled from their children, as in `ateco_2025.ipynb`.
+
+    Each level-2 row without a note takes the non-empty notes of its level-3
+    children, or failing that of its level-4 grandchildren, joined by
+    spaces. Both lookups are group-bys over the whole table, so the pass is
+    linear instead of one boolean scan per row.
+    """
+    df = pd.read_excel(path)
+    df["main"] = df["CODICE"].where(df["GERARCHIA"] == 1).ffill().fillna("")
+    df["IT_NOTA"] = df["IT_NOTA"].fillna("")
+
+    has_note = df["IT_NOTA"].str.strip() != ""
+    level_3 = df[df["GERARCHIA"] == 3]
+    from_children = df[(df["GERARCHIA"] == 3) & has_note].groupby("CODICE_PADRE", sort=False)["IT_NOTA"].agg(" ".join)
+
+    parent_of = level_3.drop_duplicates("CODICE").set_index("CODICE")["CODICE_PADRE"]
+    level_4 = df[(df["GERARCHIA"] == 4) & has_note & df["CODICE_PADRE"].isin(parent_of.index)]
+    from_grandchildren = level_4.groupby(level_4["CODICE_PADRE"].map(parent_of).values, sort=False)["IT_NOTA"].agg(" ".join)
+
+    empty_level_2 = (df["GERARCHIA"] == 2) & ~has_note
+    fill = df.loc[empty_level_2, "CODICE"].map(from_children).fillna(df.loc[empty_level_2, "CODICE"].map(from_grandchildren))
+    df.loc[empty_level_2, "IT_NOTA"] = fill.fillna(df.loc[empty_level_2, "IT_NOTA"])
+    return df
+
+
+def write_level_csvs(df: pd.DataFrame, directory: str, levels=(1, 2, 3, 4)):
+    import csv
+
+    for level in levels:
+        level_df = df[df["GERARCHIA"] == level].rename(columns={"CODICE": "code", "IT_TITOLO": "title", "IT_NOTA": "description"})
+        level_df = level_df.assign(level=LEVEL_LABELS[level]).groupby("code").aggregate({
+            "level": "first",
+            "title": "first",
+            "description": lambda x: r"\n".join(x.dropna().astype(str)),
+        }).reset_index()
+        level_df.to_csv(os.path.join(directory, f"ateco_2025_level_{level}.csv"), quoting=csv.QUOTE_ALL, index=False)
+
+
+def hierarchy_payload(df: pd.DataFrame):
+    """One node per code with its level, parent node and notes joined by "\\n"."""
+    nodes = df.groupby("CODICE", sort=False).aggregate({
+        "GERARCHIA": "first",
+        "CODICE_PADRE": "first",
+        "main": "first",
+        "IT_TITOLO": "first",
+        "IT_NOTA": lambda x: "\n".join(n for n in x if n),
+    }).reset_index()
+    index = pd.Index(nodes["CODICE"])
+    arrays = {
+        "nodes.level": nodes["GERARCHIA"].to_numpy(dtype=np.int8),
+        "nodes.parent": index.get_indexer(nodes["CODICE_PADRE"]).astype(np.int32),
+        "nodes.section": index.get_indexer(nodes["main"]).astype(np.int32),
+    }
+    strings = {"nodes.code": nodes["CODICE"].tolist(), "nodes.title": nodes["IT_TITOLO"].tolist(), "nodes.description": nodes["IT_NOTA"].tolist()}
+    return arrays, strings
+
+
+def carry_over(previous: Artifact, arrays: Dict[str, np.ndarray], strings: Dict[str, list], meta: dict, hierarchy: bool = True):
+    """Copies what a rebuild from the leaf CSV alone would lose from
+    `previous`: its hierarchy (with the workbook it was parsed from) and,
+    when the leaf texts are unchanged, its corpus vectors."""
+    leaf_source = next(iter(meta["sources"]))
+    if hierarchy and "nodes.code" in previous:
+        for name in previous.layout:
+            if name.startswith("nodes.") and not any(name.startswith(f"{s}.") for s in previous.string_names):
+                arrays[name] = np.array(previous.array(name))
+        for name in previous.string_names:
+            if name.startswith("nodes."):
+                strings[name] = previous.strings(name).tolist()
+        meta["sources"].update({p: h for p, h in previous.meta["sources"].items() if os.path.realpath(p) != leaf_source})
+
+    if previous.meta.get("texts") == meta["texts"]:
+        for model_id in previous.meta.get("models", []):
+            if model_id not in meta["models"] and previous.vectors(model_id) is not None:
+                arrays[f"vectors.{model_slug(model_id)}"] = np.array(previous.vectors(model_id))
+                meta["models"].append(model_id)
+
+
+def build_artifact(leaf_path: str, output: str = None, raw_path: str = None, model_ids: List[str] = (), batch_size: int = 64,
+                   levels_dir: str = None, workers: int = 1, previous: Artifact = None) -> Artifact:
+    """Builds the artifact of `leaf_path`. Sources are recorded by their
+    real path, so any spelling of the same file matches. `previous` (e.g.
+    an outdated artifact) supplies what is not rebuilt, see `carry_over`."""
+    output = output or artifact_path(leaf_path)
+    arrays, strings = leaf_payload(leaf_path)
+    meta = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "sources": {os.path.realpath(leaf_path): file_hash(leaf_path)},
+        "texts": text_hash("\n".join(strings["leaf.text"])),
+        "models": list(model_ids),
+    }
+
+    if raw_path:
+        raw = load_raw(raw_path)
+        if levels_dir:
+            write_level_csvs(raw, levels_dir)
+        raw_arrays, raw_strings = hierarchy_payload(raw)
+        arrays.update(raw_arrays)
+        strings.update(raw_strings)
+        meta["sources"][os.path.realpath(raw_path)] = file_hash(raw_path)
+
+    for model_id in model_ids:
+        arrays[f"vectors.{model_slug(model_id)}"] = encode(strings["leaf.text"], model_id, batch_size, workers)
+
+    if previous is not None:
+        carry_over(previous, arrays, strings, meta, hierarchy=not raw_path)
+
+    write_artifact(output, arrays, strings, meta)
+    return Artifact(output)
+
+
+def get_artifact(leaf_path: str) -> Artifact:
+    """The artifact next to `leaf_path`, rebuilt from the CSV when it is
+    missing, of another format version, or built from other CSV contents.
+    A rebuild keeps the hierarchy and, if the texts did not change, the
+    vectors of the outdated artifact."""
+    path = artifact_path(leaf_path)
+    previous = None
+    if os.path.exists(path):
+        try:
+            artifact = Artifact(path)
+            if artifact.meta["sources"].get(os.path.realpath(leaf_path)) == file_hash(leaf_path):
+                return artifact
+            previous = artifact
+        except (ValueError, KeyError, struct.error):
+            pass
+    return build_artifact(leaf_path, path, previous=previous)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("leaf", help="leaf CSV (code, title, descriptor, hierarchy, activity)")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--raw", default=None, help="ISTAT workbook to parse the hierarchy from")
+    parser.add_argument("--levels-dir", default=None, help="also write ateco_2025_level_{1..4}.csv here")
+    parser.add_argument("--model-id", nargs="*", default=[], help="embed the corpus with these models")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=1, help="encoder processes; 0 for one per core")
+    args = parser.parse_args()
+
+    if args.levels_dir and not args.raw:
+        parser.error("--levels-dir needs --raw")
+
+    start = time.perf_counter()
+    artifact = build_artifact(args.leaf, args.output, args.raw, args.model_id, args.batch_size, args.levels_dir, args.workers or None)
+
+    size = os.path.getsize(artifact.path)
+    print(f"{artifact.path}: {len(artifact.strings('leaf.text'))} texts, {len(artifact.strings('codes.code'))} codes, "
+          f"{size / 2**20:.2f} MB in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""Streaming bulk classification of free-text activity descriptions.
+
+    python -m modules.bulk data/ateco_sample_queries.csv out/sample.csv \\
+        --sep ";" --column Stringa --id-column ID --top-k 5
+
+The input is read in chunks, each chunk is embedded and ranked with the
+knowledge base, and its top-k codes are appended to the output (CSV, or a
+directory of Parquet parts when the output ends in `.parquet`). A checkpoint
+next to the output records how far the run got and with which settings, so
+re-running the same command resumes after the last completed chunk, and a
+re-run with other settings is refused instead of mixing two outputs.
+"""
+import os
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from modules.knowledge_base import get_base, aggregate_codes
+from modules.search import VectorKnowledgeBase
+from modules.query_cache import CachedKnowledgeBase
+from modules.lexical import HybridKnowledgeBase, build_lexical_index
+
+
+def checkpoint_path(output: str) -> str:
+    return output.rstrip("/") + ".checkpoint.json"
+
+
+def load_checkpoint(output: str, input_path: str, settings: dict = None) -> dict:
+    """The saved state of the run writing `output`, or a fresh one. Raises
+    `ValueError` when the saved run read another input or used other
+    `settings` (column, top_k, model, ...)."""
+    settings = settings or {}
+    path = checkpoint_path(output)
+    if not os.path.exists(path):
+        return {"input": input_path, "settings": settings, "rows": 0, "chunks": 0, "bytes": 0}
+
+    with open(path, "r") as f:
+        state = json.load(f)
+    if state["input"] != input_path:
+        raise ValueError(f"{path} belongs to a run over {state['input']}, not {input_path}")
+    if state.get("settings") != settings:
+        raise ValueError(f"{path} belongs to a run with {state.get('settings')}, not {settings}; "
+                         f"use another output or delete the checkpoint")
+    return state
+
+
+def save_checkpoint(output: str, state: dict):
+    path = checkpoint_path(output)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def classify_chunk(base: VectorKnowledgeBase, queries: pd.Series, top_k: int, search_k: int, hybrid: HybridKnowledgeBase = None) -> pd.DataFrame:
+    texts = queries.fillna("").astype(str).tolist()
+    frames = []
+
+    dense_rows = np.arange(len(texts))
+    if hybrid is not None:
+        answers = [hybrid.lexical(t, top_k) for t in texts]
+        for pos, answer in enumerate(answers):
+            if answer is not None:
+                codes, scores, source = answer
+                frames.append(pd.DataFrame({"pos": pos, "rank": np.arange(1, len(codes) + 1), "code": codes, "score": np.nan,
+                                            "lexical_score": scores, "source": source}))
+        dense_rows = np.array([pos for pos, answer in enumerate(answers) if answer is None], dtype=np.int64)
+
+    if len(dense_rows) and hybrid is None:
+        idx, scores = base.search_vectors(base.encode([texts[i] for i in dense_rows]), top_k=search_k)
+        code_ids, code_scores = aggregate_codes(base.code_ids[idx], scores, top_k=top_k)
+
+        rows, ranks = np.nonzero(code_ids >= 0)
+        frames.append(pd.DataFrame({
+            "pos": dense_rows[rows],
+            "rank": ranks + 1,
+            "code": base.code_table["code"].values[code_ids[rows, ranks]],
+            "score": code_scores[rows, ranks],
+        }))
+    elif len(dense_rows):
+        # every code the dense hits reach, fused with the lexical ranking
+        idx, scores = base.search_vectors(base.encode([texts[i] for i in dense_rows]), top_k=search_k)
+        code_ids, code_scores = aggregate_codes(base.code_ids[idx], scores)
+        code_of = base.code_table["code"].values
+        for pos, row_ids, row_scores in zip(dense_rows, code_ids, code_scores):
+            valid = row_ids >= 0
+            dense_scores = dict(zip(code_of[row_ids[valid]], row_scores[valid]))
+            lexical_codes, _, _ = hybrid.index.search(texts[pos], top_k=top_k)
+            codes, _ = hybrid.rrf([list(dense_scores), lexical_codes], top_k)
+            frames.append(pd.DataFrame({"pos": pos, "rank": np.arange(1, len(codes) + 1), "code": codes,
+                                        "score": [dense_scores.get(c, np.nan) for c in codes], "lexical_score": np.nan, "source": "hybrid"}))
+
+    result = pd.concat(frames, ignore_index=True).sort_values(["pos", "rank"], kind="stable")
+    result.insert(0, "id", queries.index.values[result["pos"]])
+    result.insert(1, "query", np.asarray(texts, dtype=object)[result["pos"]])
+    return result.drop(columns="pos").reset_index(drop=True)
+
+
+def write_chunk(df: pd.DataFrame, output: str, state: dict):
+    if output.endswith(".parquet"):
+        os.makedirs(output, exist_ok=True)
+        df.to_parquet(os.path.join(output, f"part-{state['chunks']:06d}.parquet"), index=False)
+        return
+
+    with open(output, "a", newline="") as f:
+        f.truncate(state["bytes"])
+        f.seek(state["bytes"])
+        df.to_csv(f, header=state["bytes"] == 0, index=False)
+        state["bytes"] = f.tell()
+
+
+def classify_file(
+    base: VectorKnowledgeBase,
+    input_path: str,
+    output: str,
+    column: str,
+    id_column: str = None,
+    sep: str = ",",
+    chunk_size: int = 2048,
+    top_k: int = 5,
+    search_k: int = 30,
+    hybrid: HybridKnowledgeBase = None,
+) -> dict:
+    settings = {"column": column, "id_column": id_column, "sep": sep, "top_k": top_k, "search_k": search_k,
+                "model_id": base.model_id, "lexical": hybrid is not None}
+    state = load_checkpoint(output, input_path, settings)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    reader = pd.read_csv(
+        input_path,
+        sep=sep,
+        usecols=[c for c in (column, id_column) if c],
+        dtype=str,
+        chunksize=chunk_size,
+    )
+
+    # records, not lines: a quoted field can span several lines
+    skip = state["rows"]
+    start, done = time.perf_counter(), 0
+    for chunk in reader:
+        if skip:
+            chunk, skip = chunk.iloc[skip:], max(skip - len(chunk), 0)
+            if chunk.empty:
+                continue
+        if id_column:
+            chunk = chunk.set_index(id_column)
+
+        result = classify_chunk(base, chunk[column], top_k, search_k, hybrid)
+        write_chunk(result, output, state)
+
+        state["rows"] += len(chunk)
+        state["chunks"] += 1
+        save_checkpoint(output, state)
+
+        done += len(chunk)
+        elapsed = time.perf_counter() - start
+        print(f"[{state['rows']:>9}] {done / elapsed:8.1f} queries/s", flush=True)
+
+    elapsed = time.perf_counter() - start
+    state["queries_per_second"] = done / elapsed if elapsed else 0.0
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify a file of activity descriptions into ATECO codes.")
+    parser.add_argument("input")
+    parser.add_argument("output", help="CSV file, or a directory of parts if it ends in .parquet")
+    parser.add_argument("--column", default="query")
+    parser.add_argument("--id-column", default=None)
+    parser.add_argument("--sep", default=",")
+    parser.add_argument("--kb-path", default="data/ateco_2025_leaf.csv")
+    parser.add_argument("--model-id", default="BAAI/bge-m3")
+    parser.add_argument("--chunk-size", type=int, default=2048)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--search-k", type=int, default=30, help="descriptor hits retrieved before grouping by code")
+    parser.add_argument("--lexical", action="store_true", help="answer confident index matches without the encoder, fuse index and dense rankings for the rest")
+    args = parser.parse_args()
+
+    base = CachedKnowledgeBase(get_base(args.kb_path, args.model_id, batch_size=args.batch_size), max_results=0)
+    hybrid = HybridKnowledgeBase(base, build_lexical_index(leaf_path=args.kb_path)) if args.lexical else None
+    state = classify_file(
+        base,
+        input_path=args.input,
+        output=args.output,
+        column=args.column,
+        id_column=args.id_column,
+        sep=args.sep,
+        chunk_size=args.chunk_size,
+        top_k=args.top_k,
+        search_k=args.search_k,
+        hybrid=hybrid,
+    )
+    print(f"Classified {state['rows']} rows ({state['queries_per_second']:.1f} queries/s this run)")
+    print(f"Embedding cache: {base.stats()['embeddings']} | duplicates skipped: {base.deduplicated}")
+
+
+if __name__ == "__main__":
+    main()
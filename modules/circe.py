@@ -0,0 +1,274 @@
+"""Harvest CIRCE classifications and compare them with semantic search.
+
+    python -m modules.circe data/ateco_sample_queries.csv \\
+        --checkpoint data/circe_results.jsonl --output data/circe_results.json \\
+        --concurrency 16 --rate 20 --compare
+
+Queries are posted to the CIRCE endpoint by a pool of asyncio workers that
+share one keep-alive connection pool, start at most `rate` requests per
+second and retry connection errors, timeouts, 429 and 5xx answers with
+exponential backoff. Every answer is appended to the checkpoint as one JSON
+line as soon as it arrives, so an interrupted run resumes with the queries
+that have no successful answer yet; `--output` compacts the checkpoint into
+the `circe_results.json` layout the notebooks read. `--url` can point the
+harvester at a local stub server.
+"""
+import ast
+import os
+import json
+import random
+import asyncio
+import argparse
+import numpy as np
+import pandas as pd
+from typing import Dict, List
+from modules.embeddings import EmbeddingCache
+from modules.knowledge_base import aggregate_codes
+from modules.metadata import MetadataStore
+from modules.search import VectorKnowledgeBase
+
+CIRCE_URL = "https://www.istat.it/wp-content/themes/EGPbs5-child/ateco/atecor.php"
+ERROR = "ERROR"
+LEVELS = {"divisione": 2, "gruppo": 4, "classe": 5, "categoria": 7, "sottocategoria": 8}
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class RetryableError(Exception):
+    pass
+
+
+def parse_response(text: str) -> dict:
+    """`{"0": {"code": ..., "desc": ...}, ...}` from a CIRCE answer body."""
+    response = ast.literal_eval(text.replace('""', '"'))
+    return {
+        str(j): {"code": res["ateco_code"], "desc": res["ateco_description"]}
+        for j, res in enumerate(response["0"])
+    }
+
+
+class RateLimiter:
+    """Spaces request starts at least `1 / rate` seconds apart."""
+
+    def __init__(self, rate: float = None):
+        self.interval = 1 / rate if rate else 0.0
+        self.next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            delay = self.next_start - now
+            self.next_start = max(now, self.next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def load_results(checkpoint: str) -> Dict[str, dict]:
+    """The `{idx: {"query", "result"}}` dict of a checkpoint; a later line for
+    the same query replaces an earlier one and unreadable lines are skipped."""
+    results = {}
+    if os.path.exists(checkpoint):
+        with open(checkpoint, "r") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # torn last line of an interrupted run
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                results[str(record["idx"])] = {"query": record["query"], "result": record["result"]}
+    return dict(sorted(results.items(), key=lambda item: int(item[0])))
+
+
+def truncate_torn(checkpoint: str):
+    """Cuts a torn last line off the checkpoint so appends start on a new line."""
+    if not os.path.exists(checkpoint):
+        return
+    with open(checkpoint, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+def export_results(checkpoint: str, output: str) -> Dict[str, dict]:
+    results = load_results(checkpoint)
+    with open(output + ".tmp", "w") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    os.replace(output + ".tmp", output)
+    return results
+
+
+async def fetch(session, limiter: RateLimiter, url: str, query: str, retries: int, backoff: float):
+    import aiohttp
+
+    for attempt in range(retries + 1):
+        await limiter.wait()
+        try:
+            async with session.post(url, data={"search": query}) as response:
+                if response.status in RETRY_STATUS:
+                    raise RetryableError(f"HTTP {response.status}")
+                text = await response.text()
+            try:
+                return parse_response(text)
+            except (ValueError, SyntaxError, KeyError, TypeError):
+                return ERROR
+        except (aiohttp.ClientError, asyncio.TimeoutError, RetryableError):
+            if attempt == retries:
+                return ERROR
+            await asyncio.sleep(backoff * 2 ** attempt * (1 + random.random()))
+
+
+async def harvest_async(queries: List[str], checkpoint: str, url: str = CIRCE_URL, concurrency: int = 16,
+                        rate: float = 20.0, retries: int = 5, backoff: float = 0.5, timeout: float = 30.0) -> dict:
+    import aiohttp
+
+    done = {int(idx) for idx, record in load_results(checkpoint).items() if record["result"] != ERROR}
+    todo = asyncio.Queue()
+    for idx, query in enumerate(queries):
+        if idx not in done:
+            todo.put_nowait((idx, query))
+
+    stats = {"queries": len(queries), "skipped": len(done), "done": 0, "errors": 0}
+    limiter = RateLimiter(rate)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+
+    truncate_torn(checkpoint)
+    with open(checkpoint, "a") as out:
+        async def worker(session):
+            while True:
+                try:
+                    idx, query = todo.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                result = await fetch(session, limiter, url, query, retries, backoff)
+                out.write(json.dumps({"idx": idx, "query": query, "result": result}, ensure_ascii=False) + "\n")
+                out.flush()
+                stats["done"] += 1
+                stats["errors"] += result == ERROR
+
+        async with aiohttp.ClientSession(connector=connector, headers=headers,
+                                         timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+            await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+
+    return stats
+
+
+def harvest(queries: List[str], checkpoint: str, **kwargs) -> dict:
+    return asyncio.run(harvest_async(queries, checkpoint, **kwargs))
+
+
+def average_overlap(circe_guess: List[List[str]], sem_search_guess: List[List[str]], levels=tuple(LEVELS)) -> Dict[str, dict]:
+    """Share of queries whose CIRCE and semantic codes agree at each level.
+
+    Both guess lists are flattened to (query, code) pairs once; at every level
+    the codes are truncated and a query overlaps if any of its truncated
+    CIRCE codes is among its truncated semantic codes.
+    """
+    def flatten(guess):
+        rows = np.repeat(np.arange(len(guess)), [len(g) for g in guess])
+        codes = pd.Series([c for g in guess for c in g], dtype=object)
+        return rows, codes
+
+    circe_rows, circe_codes = flatten(circe_guess)
+    sem_rows, sem_codes = flatten(sem_search_guess)
+
+    report = {}
+    for level in levels:
+        # (query, truncated code) pairs as integer keys
+        prefix_ids, prefixes = pd.factorize(pd.concat([circe_codes, sem_codes], ignore_index=True).str[:LEVELS[level]])
+        circe_keys = circe_rows * len(prefixes) + prefix_ids[:len(circe_codes)]
+        sem_keys = sem_rows * len(prefixes) + prefix_ids[len(circe_codes):]
+        overlap = np.zeros(len(circe_guess), dtype=np.int64)
+        overlap[circe_rows[np.isin(circe_keys, sem_keys)]] = 1
+        report[level] = {"average_overlap": float(overlap.mean()) if len(overlap) else float("nan"), "overlap": overlap}
+    return report
+
+
+def build_ateco_2022_base(path: str = "data/ateco_2022_raw.csv", model_id: str = "BAAI/bge-m3", batch_size: int = 16) -> VectorKnowledgeBase:
+    """Title + one chunk per " - " description item of every ATECO 2022 leaf."""
+    df = pd.read_csv(path)
+    df = df[df["section"].str.len() == 8].reset_index(drop=True)
+
+    titles = pd.DataFrame({"row": df.index, "text": df["title"].str.lower()})
+    items = (
+        df["description"].where(df["description"].map(type) == str)
+        .str.split(". Sono escluse", regex=False).str[0]
+        .str.split(" - ", regex=False)
+        .explode().dropna()
+        .str.lower().str.strip("- ")
+        .rename("text").rename_axis("row").reset_index()
+    )
+    chunks = pd.concat([titles.assign(order=0), items.assign(order=1)], ignore_index=True)
+    chunks = chunks.sort_values(["row", "order"], kind="stable").reset_index(drop=True)
+
+    texts = chunks["text"].tolist()
+    rows = chunks["row"].to_numpy()
+    return VectorKnowledgeBase(
+        texts=texts,
+        metadata=MetadataStore.from_codes(df["section"].to_numpy()[rows], title=df["title"].to_numpy()[rows]),
+        vectors=EmbeddingCache(path, model_id).get(texts, batch_size=batch_size),
+        model_id=model_id,
+        batch_size=batch_size,
+    )
+
+
+def compare(results: Dict[str, dict], queries: List[str], base: VectorKnowledgeBase, top_k: int = 10, search_k: int = 30) -> dict:
+    """CIRCE vs semantic search overlap, as in `circe_vs_semantic.ipynb`: queries
+    with a CIRCE error or an "n.c." first answer are left out, and the 8-digit
+    ATECO 2022 codes are truncated to CIRCE's 7 digits."""
+    kept = [
+        int(idx) for idx, record in results.items()
+        if record["result"] != ERROR and record["result"] and "n.c" not in record["result"]["0"]["code"]
+    ]
+    circe_guess = [sorted({r["code"] for r in results[str(i)]["result"].values()}) for i in kept]
+
+    idx, scores = base.search_vectors(base.encode([queries[i] for i in kept]), top_k=search_k)
+    code_ids, _ = aggregate_codes(base.code_ids[idx], scores, top_k=top_k)
+    code_of = base.code_table["code"].to_numpy()
+    sem_search_guess = [sorted({c[:-1] for c in code_of[row[row >= 0]]}) for row in code_ids]
+
+    return {
+        "queries": kept,
+        "circe_guess": circe_guess,
+        "sem_search_guess": sem_search_guess,
+        "overlap": average_overlap(circe_guess, sem_search_guess, levels=("divisione", "gruppo", "classe", "categoria")),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="CSV of queries")
+    parser.add_argument("--sep", default=";")
+    parser.add_argument("--column", default="Stringa")
+    parser.add_argument("--checkpoint", default="data/circe_results.jsonl")
+    parser.add_argument("--output", default="data/circe_results.json")
+    parser.add_argument("--url", default=CIRCE_URL)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rate", type=float, default=20.0, help="max requests started per second (0 = unlimited)")
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--backoff", type=float, default=0.5)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--compare", action="store_true", help="also compute the overlap with semantic search")
+    parser.add_argument("--kb-path", default="data/ateco_2022_raw.csv")
+    parser.add_argument("--model-id", default="BAAI/bge-m3")
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    queries = pd.read_csv(args.input, sep=args.sep)[args.column].fillna("").astype(str).tolist()
+    stats = harvest(
+        queries, args.checkpoint, url=args.url, concurrency=args.concurrency, rate=args.rate,
+        retries=args.retries, backoff=args.backoff, timeout=args.timeout,
+    )
+    print(f"{stats['done']} queries posted ({stats['errors']} errors), {stats['skipped']} already harvested")
+    results = export_results(args.checkpoint, args.output)
+
+    if args.compare:
+        report = compare(results, queries, build_ateco_2022_base(args.kb_path, args.model_id), top_k=args.top_k)
+        print(f"CIRCE vs Semantic Search ({args.model_id} | Top {args.top_k}, {len(report['queries'])} queries)")
+        for level, res in report["overlap"].items():
+            print(f"Average overlap ({level}): {res['average_overlap']:.3f}")
+
+
+if __name__ == "__main__":
+    main()
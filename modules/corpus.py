@@ -0,0 +1,90 @@
+import string
+import pandas as pd
+from typing import Dict
+
+LINE_BREAKS = r"\r\n|[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]"
+
+LEAF_TEMPLATE = "#{title}\n{content}.\n\nPercorso: {hierarchy}"
+
+
+def expand_template(template: str, columns: Dict[str, pd.Series]) -> pd.Series:
+    """Column-wise `template.format(**row)` for plain `{name}` fields."""
+    index = next(iter(columns.values())).index
+    out = pd.Series("", index=index, dtype=object)
+    for literal, field, _, _ in string.Formatter().parse(template):
+        if literal:
+            out = out + literal
+        if field is not None:
+            out = out + columns[field].astype(str)
+    return out
+
+
+def explode_descriptors(descriptors: pd.Series, lower_items: bool = True, strip_lines: bool = False) -> pd.Series:
+    """Vectorized `split_descriptor` over a column of descriptors.
+
+    Returns one row per descriptor item, indexed by the position of the
+    source row, in the same order as calling `split_descriptor` row by row.
+    Non-string descriptors yield no items.
+    """
+    descriptors = descriptors.reset_index(drop=True)
+    descriptors = descriptors[descriptors.map(type) == str]
+
+    blocks = descriptors.str.split("\n\n").explode().rename("block").rename_axis("row").reset_index()
+    blocks["block_pos"] = blocks.groupby("row").cumcount()
+    is_list = blocks["block"].str.contains(":\n*", regex=False)
+
+    plain = blocks[~is_list].assign(line_pos=0)
+    plain["item"] = plain["block"].str.rstrip("\n")
+
+    lines = blocks[is_list].copy()
+    lines["line"] = lines["block"].str.strip().str.split(LINE_BREAKS, regex=True)
+    lines = lines.explode("line")
+    lines["line_pos"] = lines.groupby(["row", "block_pos"]).cumcount()
+    if strip_lines:
+        lines["line"] = lines["line"].str.strip()
+
+    is_bullet = lines["line"].str.startswith("*")
+    is_header = ~is_bullet & (lines["line"] != "")
+    lines["header"] = lines["line"].str.rstrip(":").where(is_header)
+    lines["header"] = lines.groupby(["row", "block_pos"])["header"].ffill()
+
+    items = lines[is_bullet & (lines["header"].fillna("") != "")].copy()
+    content = items["line"].str[1:].str.strip()
+    if lower_items:
+        content = content.str.lower()
+    items["item"] = (items["header"] + " " + content).str.rstrip("\n")
+
+    exploded = pd.concat([plain, items])[["row", "block_pos", "line_pos", "item"]]
+    exploded = exploded.sort_values(["row", "block_pos", "line_pos"], kind="stable")
+    return exploded.set_index("row")["item"]
+
+
+def build_leaf_corpus(df: pd.DataFrame, template: str = LEAF_TEMPLATE) -> pd.DataFrame:
+    """One row per descriptor item with its embedding text and code metadata."""
+    df = df.reset_index(drop=True)
+    items = explode_descriptors(df["descriptor"])
+    rows = df.loc[items.index]
+
+    corpus = pd.DataFrame({
+        "code": rows["code"].values,
+        "title": rows["title"].values,
+        "description": rows["descriptor"].values,
+        "activity": rows["activity"].values,
+    })
+    corpus["text"] = expand_template(template, {
+        "title": rows["title"].reset_index(drop=True),
+        "content": items.reset_index(drop=True),
+        "hierarchy": rows["hierarchy"].reset_index(drop=True),
+    })
+    return corpus
+
+
+def enumerate_descriptors(descriptors: pd.Series) -> pd.Series:
+    """Vectorized `rag.parse_descriptor`: "a) ...\\n\\nb) ..." per row."""
+    descriptors = descriptors.reset_index(drop=True)
+    blocks = descriptors[descriptors.map(type) == str].str.split("\n\n").explode()
+    letters = pd.Series(list(string.ascii_lowercase))
+    position = blocks.groupby(level=0).cumcount()
+    labelled = letters.reindex(position.values).values + ") " + blocks
+    joined = labelled.groupby(level=0).agg("\n\n".join).str.rstrip("\n")
+    return joined.reindex(descriptors.index, fill_value="")
@@ -0,0 +1,227 @@
+"""ATECO 2022 -> 2025 crosswalk.
+
+    python -m modules.crosswalk build --output classification/crosswalk_2022_2025.csv
+    python -m modules.crosswalk recode registry.csv registry_2025.csv --column ateco --sep ";"
+
+Both classifications are embedded once (title and descriptor chunks, through
+their embedding caches). The similarity of a 2022 code to a 2025 code is the
+mean, over the 2022 code's chunks, of the best matching chunk of the 2025
+code. It is computed one shared prefix at a time (by default the division,
+the first two digits): 2022 chunks are only multiplied with the 2025 chunks
+of the same division, in row blocks of at most `block_size`, so memory stays
+bounded and most of the 2022 x 2025 product is never computed. Codes whose
+division has no 2025 counterpart, or whose best constrained score is below
+`min_score`, are matched against the whole 2025 corpus instead.
+
+The result is a ranked mapping table with the `top_n` 2025 candidates of
+every 2022 code. Recoding a registry is then a join on that table over the
+distinct codes of the registry, not a search per record.
+"""
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from typing import Dict
+from modules.search import VectorKnowledgeBase
+
+CROSSWALK_PATH = "classification/crosswalk_2022_2025.csv"
+COLUMNS = ["code_2022", "title_2022", "rank", "code_2025", "title_2025", "score", "constrained", "same_code"]
+
+
+def normalize_codes(codes: pd.Series) -> pd.Series:
+    """"011110", "01.11.1", " 01.11.10 " -> "01.11.10"; anything without
+    five or six digits becomes NaN."""
+    raw = codes.astype(str).str.replace(r"\D", "", regex=True)
+    valid = raw.str.len().between(5, 6)
+    digits = raw.str.ljust(6, "0")
+    return (digits.str[:2] + "." + digits.str[2:4] + "." + digits.str[4:6]).where(valid & codes.notna())
+
+
+def _groups(code_ids: np.ndarray):
+    """Row order that makes every code's chunks contiguous, the start of each
+    run in that order and the code of each run."""
+    order = np.argsort(code_ids, kind="stable")
+    sorted_ids = code_ids[order]
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]) if len(sorted_ids) else np.zeros(0, dtype=np.int64)
+    return order, starts, sorted_ids[starts]
+
+
+def _blocks(starts: np.ndarray, n_rows: int, block_size: int):
+    """Splits runs of rows into blocks of whole codes of at most
+    `block_size` rows (a single larger code gets a block of its own)."""
+    ends = np.r_[starts[1:], n_rows]
+    first = 0
+    for i in range(len(starts)):
+        if i + 1 == len(starts) or ends[i + 1] - starts[first] > block_size:
+            yield first, i + 1
+            first = i + 1
+
+
+def code_scores(source_vectors: np.ndarray, source_starts: np.ndarray, target_vectors: np.ndarray, target_starts: np.ndarray,
+                block_size: int = 1024):
+    """(n_source_codes, n_target_codes) mean-of-max chunk similarity.
+
+    Rows of both vector arrays must be grouped by code, with each code's
+    run starting at `*_starts`.
+    """
+    n_rows = len(source_vectors)
+    out = np.empty((len(source_starts), len(target_starts)), dtype=np.float32)
+    for first, last in _blocks(source_starts, n_rows, block_size):
+        row_start = source_starts[first]
+        row_end = source_starts[last] if last < len(source_starts) else n_rows
+        sims = np.asarray(source_vectors[row_start:row_end], dtype=np.float32) @ target_vectors.T
+        best = np.maximum.reduceat(sims, target_starts, axis=1)
+        local = source_starts[first:last] - row_start
+        counts = np.diff(np.r_[local, row_end - row_start])
+        out[first:last] = np.add.reduceat(best, local, axis=0) / counts[:, None]
+    return out
+
+
+def build_crosswalk(source: VectorKnowledgeBase, target: VectorKnowledgeBase, prefix_length: int = 2, top_n: int = 5,
+                    min_score: float = 0.5, block_size: int = 1024) -> pd.DataFrame:
+    """Ranked `top_n` target codes for every source code, see the module
+    docstring; `prefix_length=0` disables the prefix constraint."""
+    source_codes = source.code_table["code"].to_numpy(dtype=object)
+    target_codes = target.code_table["code"].to_numpy(dtype=object)
+    src_order, src_starts, src_ids = _groups(np.asarray(source.code_ids))
+    dst_order, dst_starts, dst_ids = _groups(np.asarray(target.code_ids))
+    src_vectors = np.asarray(source.vectors)[src_order]
+    dst_vectors = np.asarray(target.vectors)[dst_order]
+
+    src_prefix = pd.Series(source_codes[src_ids]).str[:prefix_length].to_numpy()
+    dst_prefix = pd.Series(target_codes[dst_ids]).str[:prefix_length].to_numpy()
+    src_ends = np.r_[src_starts[1:], len(src_order)]
+    dst_ends = np.r_[dst_starts[1:], len(dst_order)]
+
+    def rank(src_runs: np.ndarray, dst_runs: np.ndarray, constrained: bool) -> pd.DataFrame:
+        rows = np.concatenate([np.arange(src_starts[i], src_ends[i]) for i in src_runs])
+        cols = np.concatenate([np.arange(dst_starts[j], dst_ends[j]) for j in dst_runs])
+        scores = code_scores(
+            src_vectors[rows], np.r_[0, np.cumsum(src_ends[src_runs] - src_starts[src_runs])[:-1]],
+            dst_vectors[cols], np.r_[0, np.cumsum(dst_ends[dst_runs] - dst_starts[dst_runs])[:-1]],
+            block_size,
+        )
+        n = min(top_n, len(dst_runs))
+        best = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+        best = np.take_along_axis(best, np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1, kind="stable"), axis=1)
+        return pd.DataFrame({
+            "source": np.repeat(src_ids[src_runs], n),
+            "rank": np.tile(np.arange(1, n + 1), len(src_runs)),
+            "target": dst_ids[dst_runs][best].ravel(),
+            "score": np.take_along_axis(scores, best, axis=1).ravel(),
+            "constrained": constrained,
+        })
+
+    frames = []
+    all_targets = np.arange(len(dst_ids))
+    if prefix_length:
+        for prefix in pd.unique(src_prefix):
+            src_runs = np.flatnonzero(src_prefix == prefix)
+            dst_runs = np.flatnonzero(dst_prefix == prefix)
+            if len(dst_runs):
+                frames.append(rank(src_runs, dst_runs, True))
+        ranked = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["source", "score"])
+        best = ranked[ranked["rank"] == 1].set_index("source")["score"] if len(ranked) else pd.Series(dtype=np.float32)
+        fallback = np.flatnonzero(~(best.reindex(src_ids).fillna(-np.inf).to_numpy() >= min_score))
+        frames = [ranked[~ranked["source"].isin(src_ids[fallback])]] if len(ranked) else []
+    else:
+        fallback = np.arange(len(src_ids))
+    if len(fallback):
+        frames.append(rank(fallback, all_targets, False))
+
+    table = pd.concat(frames, ignore_index=True).sort_values(["source", "rank"], kind="stable")
+    out = pd.DataFrame({
+        "code_2022": source_codes[table["source"].to_numpy()],
+        "title_2022": source.code_table["title"].to_numpy(dtype=object)[table["source"].to_numpy()] if "title" in source.code_table else "",
+        "rank": table["rank"].to_numpy(),
+        "code_2025": target_codes[table["target"].to_numpy()],
+        "title_2025": target.code_table["title"].to_numpy(dtype=object)[table["target"].to_numpy()] if "title" in target.code_table else "",
+        "score": table["score"].to_numpy(dtype=np.float32).round(4),
+        "constrained": table["constrained"].to_numpy(dtype=bool),
+    })
+    out["same_code"] = out["code_2022"] == out["code_2025"]
+    return out.sort_values(["code_2022", "rank"], kind="stable").reset_index(drop=True)[COLUMNS]
+
+
+def get_crosswalk(path: str = CROSSWALK_PATH, model_id: str = "BAAI/bge-m3", rebuild: bool = False, **kwargs) -> pd.DataFrame:
+    """The mapping table at `path`, built (and saved) when missing."""
+    if os.path.exists(path) and not rebuild:
+        return pd.read_csv(path, dtype={"code_2022": str, "code_2025": str})
+
+    from modules.circe import build_ateco_2022_base
+    from modules.knowledge_base import get_base
+
+    table = build_crosswalk(
+        build_ateco_2022_base(model_id=model_id),
+        get_base(path="data/ateco_2025_leaf.csv", model_id=model_id),
+        **kwargs,
+    )
+    table.to_csv(path, index=False)
+    return table
+
+
+def recode(codes: pd.Series, table: pd.DataFrame, rank: int = 1) -> pd.DataFrame:
+    """2025 code, title and score of the `rank`-th candidate of each 2022
+    code in `codes` (index preserved). Codes are normalized and looked up
+    once per distinct value; unknown codes get NaN."""
+    mapping = table[table["rank"] == rank].set_index("code_2022")
+    ids, uniques = pd.factorize(codes)
+    position = mapping.index.get_indexer(normalize_codes(pd.Series(uniques, dtype=object)))
+
+    # -1 (missing input) and unknown codes both point at the NaN row
+    lookup = np.where(position >= 0, position, len(mapping))
+    rows = np.where(ids >= 0, lookup[ids] if len(lookup) else len(mapping), len(mapping))
+    padded = {c: np.r_[mapping[c].to_numpy(dtype=object), np.nan] for c in ("code_2025", "title_2025", "score")}
+    return pd.DataFrame({c: v[rows] for c, v in padded.items()}, index=codes.index).astype({"score": np.float32})
+
+
+def recode_file(input_path: str, output: str, column: str, table: pd.DataFrame, sep: str = ",", chunk_size: int = 500_000, rank: int = 1) -> Dict[str, int]:
+    """Appends `<column>_2025`, `<column>_2025_title` and `<column>_2025_score`
+    to every row of a CSV, `chunk_size` rows at a time."""
+    stats = {"rows": 0, "unmatched": 0}
+    reader = pd.read_csv(input_path, sep=sep, dtype={column: str}, chunksize=chunk_size)
+    for i, chunk in enumerate(reader):
+        recoded = recode(chunk[column], table, rank=rank)
+        chunk[f"{column}_2025"] = recoded["code_2025"]
+        chunk[f"{column}_2025_title"] = recoded["title_2025"]
+        chunk[f"{column}_2025_score"] = recoded["score"]
+        chunk.to_csv(output, sep=sep, index=False, mode="w" if i == 0 else "a", header=i == 0)
+        stats["rows"] += len(chunk)
+        stats["unmatched"] += int(recoded["code_2025"].isna().sum())
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ATECO 2022 -> 2025 crosswalk")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="build the ranked mapping table")
+    build.add_argument("--output", default=CROSSWALK_PATH)
+    build.add_argument("--model-id", default="BAAI/bge-m3")
+    build.add_argument("--prefix-length", type=int, default=2)
+    build.add_argument("--top-n", type=int, default=5)
+    build.add_argument("--min-score", type=float, default=0.5)
+    build.add_argument("--block-size", type=int, default=1024)
+
+    rec = commands.add_parser("recode", help="recode the 2022 codes of a CSV")
+    rec.add_argument("input")
+    rec.add_argument("output")
+    rec.add_argument("--column", required=True)
+    rec.add_argument("--sep", default=",")
+    rec.add_argument("--table", default=CROSSWALK_PATH)
+    rec.add_argument("--rank", type=int, default=1)
+    rec.add_argument("--chunk-size", type=int, default=500_000)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        table = get_crosswalk(args.output, args.model_id, rebuild=True, prefix_length=args.prefix_length,
+                              top_n=args.top_n, min_score=args.min_score, block_size=args.block_size)
+        top = table[table["rank"] == 1]
+        print(f"{top['code_2022'].nunique()} codes, {int(top['same_code'].sum())} keep their code, "
+              f"{int((~top['constrained']).sum())} matched outside their division")
+    else:
+        print(recode_file(args.input, args.output, args.column, get_crosswalk(args.table), args.sep, args.chunk_size, args.rank))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import os
+import json
+import hashlib
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+_models = {}
+_models_lock = threading.Lock()
+_encode_locks = {}
+
+
+def load_model(model_id: str):
+    with _models_lock:
+        if model_id not in _models:
+            from sentence_transformers import SentenceTransformer
+            _models[model_id] = SentenceTransformer(model_id)
+            _encode_locks[model_id] = threading.Lock()
+        return _models[model_id]
+
+
+def encode(texts: List[str], model_id: str, batch_size: int = 64, workers: int = 1) -> np.ndarray:
+    if workers != 1:
+        return encode_parallel(texts, model_id, batch_size, workers)
+    model = load_model(model_id)
+    with _encode_locks[model_id]:
+        vectors = model.encode(
+            texts,
+            batch_size=batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def length_shards(texts: List[str], n_shards: int, batch_size: int = 64) -> List[np.ndarray]:
+    """Indices of `texts` dealt into `n_shards` shards of similar cost.
+
+    Texts are sorted by length and cut into batches; batches go, costliest
+    first, to the shard with the least work so far, the cost of a batch
+    being its padded size (size x longest text). Every shard lists its
+    indices shortest first, so its own batches stay length-bucketed.
+    """
+    lengths = np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts))
+    order = np.argsort(lengths, kind="stable")
+    batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+    costs = [len(b) * lengths[b[-1]] for b in batches]
+
+    load = np.zeros(n_shards, dtype=np.int64)
+    shards = [[] for _ in range(n_shards)]
+    for i in sorted(range(len(batches)), key=lambda i: -costs[i]):
+        target = int(np.argmin(load))
+        shards[target].append(batches[i])
+        load[target] += costs[i]
+    shards = [np.concatenate(s) if s else np.zeros(0, dtype=np.int64) for s in shards]
+    return [s[np.argsort(lengths[s], kind="stable")] for s in shards]
+
+
+def _init_worker(threads: int):
+    import torch
+    torch.set_num_threads(threads)
+
+
+def _encode_shard(texts: List[str], model_id: str, batch_size: int) -> np.ndarray:
+    return encode(texts, model_id, batch_size)
+
+
+def encode_parallel(texts: List[str], model_id: str, batch_size: int = 64, workers: int = None) -> np.ndarray:
+    """`encode` sharded over a pool of `workers` processes (default: one per
+    core), each with its own copy of the model and an equal share of the
+    cores for torch.
+
+    Shards come from `length_shards` and their vectors are written back at
+    the texts' original positions, so the output order does not depend on
+    which worker finishes first. Every worker loads the model, so this pays
+    off for index builds, not for a handful of queries.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(texts) <= batch_size:
+        return encode(texts, model_id, batch_size)
+
+    shards = [s for s in length_shards(texts, workers, batch_size) if len(s)]
+    threads = max(1, (os.cpu_count() or 1) // len(shards))
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(len(shards), mp_context=context, initializer=_init_worker, initargs=(threads,)) as pool:
+        futures = [pool.submit(_encode_shard, [texts[i] for i in shard], model_id, batch_size) for shard in shards]
+        vectors = None
+        for shard, future in zip(shards, futures):
+            part = future.result()
+            if vectors is None:
+                vectors = np.empty((len(texts), part.shape[1]), dtype=np.float32)
+            vectors[shard] = part
+    return vectors
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def model_slug(model_id: str) -> str:
+    return model_id.replace("/", "__")
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache stored next to a corpus file.
+
+    Vectors live in `<stem>.<model>.vectors.npy` (loaded memory-mapped) and
+    their text hashes in `<stem>.<model>.keys.json`. Only texts whose hash is
+    not in the cache are sent to the encoder.
+    """
+
+    def __init__(self, path: str, model_id: str):
+        root, _ = os.path.splitext(path)
+        prefix = f"{root}.{model_slug(model_id)}"
+        self.model_id = model_id
+        self.vectors_path = f"{prefix}.vectors.npy"
+        self.keys_path = f"{prefix}.keys.json"
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        if not (os.path.exists(self.vectors_path) and os.path.exists(self.keys_path)):
+            return [], None
+
+        with open(self.keys_path, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("model_id") != self.model_id:
+            return [], None
+
+        vectors = np.load(self.vectors_path, mmap_mode="r")
+        if vectors.shape[0] != len(manifest["keys"]):
+            return [], None
+
+        return manifest["keys"], vectors
+
+    def save(self, keys: List[str], vectors: np.ndarray):
+        tmp_vectors = self.vectors_path + ".tmp.npy"
+        tmp_keys = self.keys_path + ".tmp"
+
+        np.save(tmp_vectors, np.ascontiguousarray(vectors, dtype=np.float32))
+        with open(tmp_keys, "w") as f:
+            json.dump({"model_id": self.model_id, "keys": keys}, f)
+
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_keys, self.keys_path)
+
+    def get(self, texts: List[str], batch_size: int = 64, workers: int = 1) -> np.ndarray:
+        keys = [text_hash(t) for t in texts]
+        cached_keys, cached = self.load()
+
+        if cached is not None and cached_keys == keys:
+            self.hits += len(keys)
+            return cached
+
+        position = {k: i for i, k in enumerate(cached_keys)}
+        missing = [i for i, k in enumerate(keys) if k not in position]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        if cached is not None:
+            dim = cached.shape[1]
+        else:
+            dim = None
+
+        new_vectors = encode([texts[i] for i in missing], self.model_id, batch_size, workers) if missing else None
+        if dim is None:
+            dim = new_vectors.shape[1] if new_vectors is not None else 0
+
+        vectors = np.empty((len(keys), dim), dtype=np.float32)
+        found = [(i, position[k]) for i, k in enumerate(keys) if k in position]
+        if found:
+            rows, src = map(np.asarray, zip(*found))
+            vectors[rows] = cached[src]
+        if missing:
+            vectors[np.asarray(missing)] = new_vectors
+
+        del cached
+        self.save(keys, vectors)
+        _, mapped = self.load()
+        return mapped
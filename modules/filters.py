@@ -0,0 +1,178 @@
+import os
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Union
+from modules.artifact import Artifact
+from modules.knowledge_base import codes_frame, parse_retrieved_batch
+from modules.metrics import METRICS, timed
+from modules.search import QueryResult
+
+LEVELS_PATH = "classification/ateco_2025/ateco_2025_full.csv"
+FIELDS = ("activity", "section", "prefix", "hierarchy")
+
+Values = Union[str, List[str]]
+
+
+def _key(value: str) -> str:
+    return str(value).strip().lower()
+
+
+def division_sections(path: str = LEVELS_PATH) -> Dict[str, str]:
+    """Division ("01") -> section letter ("A"), from the level table."""
+    if not os.path.exists(path):
+        return {}
+    levels = pd.read_csv(path, usecols=["main", "code", "level"], dtype=str)
+    divisions = levels[levels["level"] == "divisione"]
+    return dict(zip(divisions["code"], divisions["main"]))
+
+
+class FilterIndex:
+    """Precomputed postings of the codes matching each filter value.
+
+    For every field (`activity`; `section` letter; `prefix`, any code prefix
+    such as "01", "01.1" or "01.11"; `hierarchy`, any node title on a code's
+    path) a value maps to the sorted ids of its codes. Corpus rows are kept
+    grouped by code, so a filter selects its rows as whole slices and never
+    looks at the other rows.
+    """
+
+    def __init__(self, code_ids: np.ndarray, codes: List[str], activity: List[str], hierarchy: List[str],
+                 sections: Dict[str, str] = None):
+        self.n_codes = len(codes)
+        self.order = np.argsort(code_ids, kind="stable")
+        self.offsets = np.searchsorted(np.asarray(code_ids)[self.order], np.arange(self.n_codes + 1))
+
+        sections = sections or {}
+        postings = {field: {} for field in FIELDS}
+        for i, (code, act, path) in enumerate(zip(codes, activity, hierarchy)):
+            postings["activity"].setdefault(_key(act), []).append(i)
+            if code[:2] in sections:
+                postings["section"].setdefault(_key(sections[code[:2]]), []).append(i)
+            for length in range(1, len(code) + 1):
+                postings["prefix"].setdefault(code[:length], []).append(i)
+            for node in dict.fromkeys(str(path).split(" > ") if path else []):
+                postings["hierarchy"].setdefault(_key(node), []).append(i)
+
+        self.postings = {field: {v: np.array(ids, dtype=np.int32) for v, ids in values.items()} for field, values in postings.items()}
+        self.labels = {"activity": list(dict.fromkeys(activity)), "section": sorted(set(sections.values()))}
+
+    @classmethod
+    def from_artifact(cls, artifact: Artifact, levels_path: str = LEVELS_PATH) -> "FilterIndex":
+        return cls(
+            np.asarray(artifact.array("leaf.code_id")),
+            artifact.strings("codes.code").tolist(),
+            artifact.strings("codes.activity").tolist(),
+            artifact.strings("codes.hierarchy").tolist(),
+            division_sections(levels_path),
+        )
+
+    def values(self, field: str) -> List[str]:
+        """Labels of `activity` or `section`, in corpus order."""
+        return self.labels[field]
+
+    def codes(self, activity: Values = None, section: Values = None, prefix: Values = None, hierarchy: Values = None) -> np.ndarray:
+        """Sorted ids of the codes matching every given field (several values
+        of a field are alternatives); None when no filter is given."""
+        mask = None
+        for field, values in zip(FIELDS, (activity, section, prefix, hierarchy)):
+            if values is None:
+                continue
+            values = [values] if isinstance(values, str) else values
+            matching = np.zeros(self.n_codes, dtype=bool)
+            for value in values:
+                matching[self.postings[field].get(value.strip() if field == "prefix" else _key(value), [])] = True
+            mask = matching if mask is None else mask & matching
+        return None if mask is None else np.flatnonzero(mask)
+
+    def rows(self, code_ids: np.ndarray):
+        """Corpus rows of `code_ids`, grouped by code, and the start of each
+        code's run."""
+        sizes = self.offsets[code_ids + 1] - self.offsets[code_ids]
+        starts = np.r_[0, np.cumsum(sizes)[:-1]] if len(code_ids) else np.zeros(0, dtype=np.int64)
+        rows = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in code_ids]) if len(code_ids) else np.zeros(0, dtype=np.int64)
+        return rows, starts
+
+
+class FilteredKnowledgeBase:
+    """Knowledge base front with `where` filters backed by a `FilterIndex`.
+
+    A filtered search scores the query only against the vectors of the
+    matching codes, so it returns `top_k` hits (or codes, with
+    `search_codes`) satisfying the filter whenever that many exist, however
+    low they would rank in the whole corpus. `where` holds the keyword
+    arguments of `FilterIndex.codes`, e.g. `{"activity": "Commercio al
+    dettaglio"}` or `{"prefix": ["46", "47"]}`. Without it, calls go to the
+    wrapped base; other attributes are forwarded to it.
+    """
+
+    def __init__(self, base, index: FilterIndex):
+        if len(index.order) != len(base):
+            raise ValueError(f"Filter index covers {len(index.order)} rows, the base has {len(base)}")
+        self.base = base
+        self.index = index
+
+    def __getattr__(self, name):
+        return getattr(self.base, name)
+
+    def __len__(self):
+        return len(self.base)
+
+    def _select(self, where: dict):
+        code_ids = self.index.codes(**where)
+        if code_ids is None:
+            code_ids = np.arange(self.index.n_codes)
+        # codes without rows would give empty runs, which reduceat cannot take
+        code_ids = code_ids[self.index.offsets[code_ids + 1] > self.index.offsets[code_ids]]
+        rows, starts = self.index.rows(code_ids)
+        return code_ids, rows, starts
+
+    def search_vectors(self, query_vectors: np.ndarray, top_k: int = 5, where: dict = None):
+        if not where:
+            return self.base.search_vectors(query_vectors, top_k)
+
+        with METRICS.timer("filtered_search"):
+            _, rows, _ = self._select(where)
+            n = len(query_vectors)
+            idx = np.zeros((n, top_k), dtype=np.int64)
+            scores = np.full((n, top_k), -np.inf, dtype=np.float32)
+            if len(rows):
+                row_scores = query_vectors @ np.asarray(self.base.vectors[rows], dtype=np.float32).T
+                k = min(top_k, len(rows))
+                best = np.argpartition(-row_scores, k - 1, axis=1)[:, :k]
+                best = np.take_along_axis(best, np.argsort(-np.take_along_axis(row_scores, best, axis=1), axis=1, kind="stable"), axis=1)
+                idx[:, :k] = rows[best]
+                scores[:, :k] = np.take_along_axis(row_scores, best, axis=1)
+            return idx, scores
+
+    def search(self, query: Union[str, List[str]], top_k: int = 5, where: dict = None) -> List[QueryResult]:
+        if not where:
+            return self.base.search(query, top_k)
+        queries = [query] if isinstance(query, str) else list(query)
+        idx, scores = self.search_vectors(self.encode(queries), top_k, where)
+        return self.to_results(queries, idx, scores)
+
+    def search_codes(self, query: Union[str, List[str]], top_k: int = 5, where: dict = None, search_k: int = None) -> List[pd.DataFrame]:
+        """The `top_k` codes (best chunk score per code) matching `where` for
+        each query, as the DataFrames of `parse_retrieved`.
+
+        Without `where` this is the wrapped base's (cached, indexed) search
+        for `search_k` hits (default `10 * top_k`), aggregated by code.
+        """
+        queries = [query] if isinstance(query, str) else list(query)
+        if not where:
+            results = self.base.search(queries, top_k=search_k or 10 * top_k)
+            return parse_retrieved_batch(results, self, top_k=top_k, as_frame=True)
+        return self._search_codes(queries, top_k, where)
+
+    @timed("filtered_search")
+    def _search_codes(self, queries: List[str], top_k: int, where: dict) -> List[pd.DataFrame]:
+        code_ids, rows, starts = self._select(where)
+        if not len(rows):
+            return [codes_frame(self.code_table, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in queries]
+
+        row_scores = self.encode(queries) @ np.asarray(self.base.vectors[rows], dtype=np.float32).T
+        best = np.maximum.reduceat(row_scores, starts, axis=1)
+        k = min(top_k, len(code_ids))
+        top = np.argpartition(-best, k - 1, axis=1)[:, :k]
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(best, top, axis=1), axis=1, kind="stable"), axis=1)
+        return [codes_frame(self.code_table, code_ids[t], b[t]) for t, b in zip(top, best)]
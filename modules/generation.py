@@ -0,0 +1,301 @@
+import time
+import queue
+import threading
+from typing import List
+from modules.metrics import METRICS
+
+_DONE = object()
+
+
+class GenerationRequest:
+    def __init__(self, prompt: str, max_new_tokens: int, session_id: str = None, prefix: str = None):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.session_id = session_id
+        self.prefix = prefix
+        self.turn = {}
+        self.chunks = queue.Queue()
+        self.tokens = []
+        self.text = ""
+        self.finished = False
+        self.submitted = time.perf_counter()
+        self.first_token = None
+        self.completed = None
+
+    def __iter__(self):
+        while True:
+            chunk = self.chunks.get()
+            if chunk is _DONE:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    @property
+    def time_to_first_token(self) -> float:
+        return self.first_token - self.submitted if self.first_token else None
+
+
+class BatchStreamer:
+    """Routes the tokens of a batched `generate` call to per-request queues.
+
+    Implements the `put`/`end` protocol of `transformers` streamers: the first
+    `put` carries the (padded) prompts and is skipped, every later one carries
+    one new token per batch row. A row stops streaming at EOS or at its own
+    `max_new_tokens`; `all_finished` lets a stopping criterion end the batch.
+    """
+
+    def __init__(self, tokenizer, requests: List[GenerationRequest]):
+        self.tokenizer = tokenizer
+        self.requests = requests
+        self.eos_token_ids = set(self._eos_ids(tokenizer))
+        self.prompt_seen = False
+
+    @staticmethod
+    def _eos_ids(tokenizer):
+        eos = tokenizer.eos_token_id
+        ids = eos if isinstance(eos, list) else [eos]
+        eot = tokenizer.convert_tokens_to_ids("<|eot_id|>") if "<|eot_id|>" in tokenizer.get_vocab() else None
+        return [i for i in ids + [eot] if i is not None]
+
+    def put(self, value):
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+
+        tokens = value.reshape(len(self.requests), -1)[:, -1].tolist()
+        now = time.perf_counter()
+        for request, token in zip(self.requests, tokens):
+            if request.finished:
+                continue
+            if token in self.eos_token_ids:
+                self.finish(request)
+                continue
+
+            request.tokens.append(token)
+            text = self.tokenizer.decode(request.tokens, skip_special_tokens=True)
+            chunk, request.text = text[len(request.text):], text
+            if chunk:
+                if request.first_token is None:
+                    request.first_token = now
+                request.chunks.put(chunk)
+            if len(request.tokens) >= request.max_new_tokens:
+                self.finish(request)
+
+    def finish(self, request: GenerationRequest):
+        if not request.finished:
+            request.finished = True
+            request.completed = time.perf_counter()
+            request.chunks.put(_DONE)
+
+    def end(self):
+        for request in self.requests:
+            self.finish(request)
+
+    def all_finished(self) -> bool:
+        return all(r.finished for r in self.requests)
+
+
+class GenerationScheduler:
+    """Serves concurrent generation requests from one shared `Llama`.
+
+    Requests wait in a bounded queue; a single worker thread takes the oldest
+    one and keeps collecting more for at most `batch_window` seconds (or until
+    `max_batch_size`), then runs them as one left-padded `generate` call with
+    a streamer per request. A batch of one goes through
+    `Llama.generate_cached`, reusing the pinned system prompt and the
+    session's previous turn.
+
+    Admission control keeps time to first token under `ttft_target` seconds:
+    `submit` estimates how long a new request would wait for the running
+    batch and the batches queued ahead of it to generate their
+    `max_new_tokens` (from moving averages of past prefill and per-token
+    times), and raises `queue.Full` when that exceeds the target, as it does
+    when `max_pending` requests are already waiting. An idle scheduler
+    always admits, and the first batch after the queue drains restarts the
+    averages, so one slow (e.g. cold) batch cannot keep rejecting requests.
+    `ttft_target=None` admits everything.
+    """
+
+    def __init__(self, llm, max_batch_size: int = 8, max_pending: int = 64, batch_window: float = 0.05,
+                 ttft_target: float = 1.0, do_sample: bool = True, top_p: float = 0.9):
+        self.llm = llm
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.ttft_target = ttft_target
+        self.generate_kwargs = {"do_sample": do_sample, "top_p": top_p}
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.stats = {"requests": 0, "batches": 0, "tokens": 0, "generate_seconds": 0.0, "ttft": [], "rejected": 0}
+        self._stats_lock = threading.Lock()
+        # moving averages of prefill and per-token decode time, for admission
+        self._prefill_seconds = None
+        self._token_seconds = None
+        self._running_until = None
+        self._restart_averages = False
+
+        tokenizer = llm.tokenizer
+        tokenizer.padding_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def _batch_seconds(self, max_new_tokens: List[int]) -> float:
+        return self._prefill_seconds + max(max_new_tokens) * self._token_seconds
+
+    def expected_wait(self) -> float:
+        """Estimated time a request submitted now waits before its batch
+        starts; 0 when nothing is queued or running, or no batch has been
+        timed yet."""
+        with self._stats_lock:
+            if self._token_seconds is None:
+                return 0.0
+            with self.pending.mutex:
+                ahead = [r.max_new_tokens for r in self.pending.queue]
+            # the request joins the last batch when it has room
+            full = len(ahead) // self.max_batch_size * self.max_batch_size
+            wait = sum(self._batch_seconds(ahead[i:i + self.max_batch_size]) for i in range(0, full, self.max_batch_size))
+            if self._running_until is not None:
+                wait += max(self._running_until - time.perf_counter(), 0.0)
+            return wait
+
+    def submit(self, prompt: str, max_new_tokens: int = 100, timeout: float = None, session_id: str = None, prefix: str = None) -> GenerationRequest:
+        if self.ttft_target is not None:
+            expected = self.expected_wait()
+            if expected > self.ttft_target:
+                with self._stats_lock:
+                    self.stats["rejected"] += 1
+                METRICS.inc("llm_rejected")
+                raise queue.Full(f"Expected wait of {expected:.2f}s exceeds the {self.ttft_target:.2f}s TTFT target")
+        request = GenerationRequest(prompt, max_new_tokens, session_id, prefix)
+        self.pending.put(request, timeout=timeout)
+        return request
+
+    def stream(self, system: str, instruction: str, max_new_tokens: int = 100):
+        yield from self.submit(self.llm.parse_prompt(system, instruction), max_new_tokens, prefix=self.llm.parse_system(system))
+
+    def stream_with_history(self, system: str, messages: List[str], max_new_tokens: int = 100, session_id: str = None):
+        yield from self.submit(
+            self.llm.parse_history(system, messages),
+            max_new_tokens,
+            session_id=session_id,
+            prefix=self.llm.parse_system(system),
+        )
+
+    def _collect(self) -> List[GenerationRequest]:
+        batch = [self.pending.get()]
+        deadline = time.perf_counter() + self.batch_window
+        if self.ttft_target is not None:
+            deadline = min(deadline, batch[0].submitted + self.ttft_target)
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.pending.get(timeout=max(remaining, 0)) if remaining > 0 else self.pending.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._generate(batch)
+            except Exception as e:
+                for request in batch:
+                    if not request.finished:
+                        request.finished = True
+                        request.chunks.put(e)
+                        request.chunks.put(_DONE)
+
+    def _generate(self, batch: List[GenerationRequest]):
+        from transformers import StoppingCriteria, StoppingCriteriaList
+
+        tokenizer, model = self.llm.tokenizer, self.llm.model
+        start = time.perf_counter()
+        with self._stats_lock:
+            # after the queue drained, the averages may be stale until this batch is timed
+            if self._token_seconds is not None and not self._restart_averages:
+                self._running_until = start + self._batch_seconds([r.max_new_tokens for r in batch])
+
+        if len(batch) == 1 and hasattr(self.llm, "generate_cached"):
+            # a lone request can reuse the cached system/session prefix
+            request = batch[0]
+            streamer = BatchStreamer(tokenizer, batch)
+            request.turn = self.llm.generate_cached(
+                request.prompt,
+                streamer,
+                max_new_tokens=request.max_new_tokens,
+                session_id=request.session_id,
+                prefix=request.prefix,
+                pad_token_id=tokenizer.pad_token_id,
+                **self.generate_kwargs,
+            )
+            # stats first, so a client reading them when its stream ends sees its request
+            self._record(batch, start)
+            streamer.end()
+            return
+
+        inputs = tokenizer([r.prompt for r in batch], return_tensors="pt", padding=True).to(model.device)
+        streamer = BatchStreamer(tokenizer, batch)
+
+        class AllFinished(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                import torch
+                return torch.tensor([r.finished for r in batch], device=input_ids.device)
+
+        model.generate(
+            input_ids=inputs["input_ids"],
+            attention_mask=inputs["attention_mask"],
+            streamer=streamer,
+            max_new_tokens=max(r.max_new_tokens for r in batch),
+            stopping_criteria=StoppingCriteriaList([AllFinished()]),
+            pad_token_id=tokenizer.pad_token_id,
+            **self.generate_kwargs,
+        )
+        self._record(batch, start)
+        streamer.end()
+
+    def _record(self, batch: List[GenerationRequest], start: float):
+        now = time.perf_counter()
+        prefills = [r.first_token - start for r in batch if r.first_token]
+        decoded = max((len(r.tokens) for r in batch), default=0)
+        with self._stats_lock:
+            self.stats["requests"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["tokens"] += sum(len(r.tokens) for r in batch)
+            self.stats["generate_seconds"] += now - start
+            self.stats["ttft"].extend(r.time_to_first_token for r in batch if r.first_token)
+            self.stats["ttft"] = self.stats["ttft"][-1000:]
+            if prefills and decoded:
+                prefill = min(prefills)
+                per_token = max(now - start - prefill, 0.0) / decoded
+                fresh = self._token_seconds is None or self._restart_averages
+                self._prefill_seconds = prefill if fresh else 0.8 * self._prefill_seconds + 0.2 * prefill
+                self._token_seconds = per_token if fresh else 0.8 * self._token_seconds + 0.2 * per_token
+            self._restart_averages = self.pending.empty()
+            self._running_until = None
+
+        for r in batch:
+            METRICS.observe_time("llm_queue", start - r.submitted)
+            if r.first_token:
+                METRICS.observe_time("llm_prefill", r.first_token - start)
+                METRICS.observe_time("llm_ttft", r.time_to_first_token)
+            completed = r.completed or now
+            if r.first_token and completed > r.first_token:
+                METRICS.observe("llm_tokens_per_second", len(r.tokens) / (completed - r.first_token))
+        METRICS.inc("llm_tokens", sum(len(r.tokens) for r in batch))
+
+    def throughput(self) -> dict:
+        with self._stats_lock:
+            seconds = self.stats["generate_seconds"]
+            ttft = sorted(self.stats["ttft"])
+            return {
+                "requests": self.stats["requests"],
+                "mean_batch_size": self.stats["requests"] / self.stats["batches"] if self.stats["batches"] else 0.0,
+                "tokens_per_second": self.stats["tokens"] / seconds if seconds else 0.0,
+                "p50_ttft": ttft[len(ttft) // 2] if ttft else None,
+                "p95_ttft": ttft[int(len(ttft) * 0.95)] if ttft else None,
+                "ttft_target": self.ttft_target,
+                "rejected": self.stats["rejected"],
+            }
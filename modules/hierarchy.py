@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+from typing import List, Tuple, Union
+from modules.corpus import expand_template
+from modules.embeddings import EmbeddingCache
+from modules.search import QueryResult, VectorKnowledgeBase
+
+LEVELS_PATH = "classification/ateco_2025/ateco_2025_full.csv"
+LEVEL_TEMPLATE = "#{title}\n{description}"
+
+# level name in the classification table -> length of the code prefix
+PREFIX = {"sezione": None, "divisione": 2, "gruppo": 4, "classe": 5}
+
+
+class HierarchicalKnowledgeBase:
+    """Coarse-to-fine search over a leaf `VectorKnowledgeBase`.
+
+    Each query is first scored against the nodes of the coarse levels
+    (e.g. sections, then divisions); only the `beam` best nodes of a level are
+    expanded to their children, and the multi-vector leaf search runs on the
+    descriptor vectors of the surviving subtrees only.
+    """
+
+    def __init__(self, base: VectorKnowledgeBase, levels: List[dict], leaf_parent: np.ndarray):
+        self.base = base
+        self.levels = levels
+        self.leaf_order = np.argsort(leaf_parent, kind="stable")
+        self.leaf_offsets = np.searchsorted(leaf_parent[self.leaf_order], np.arange(len(levels[-1]["codes"]) + 1))
+
+    def __getattr__(self, name):
+        return getattr(self.base, name)
+
+    def leaf_rows(self, nodes: np.ndarray) -> np.ndarray:
+        return np.concatenate([self.leaf_order[self.leaf_offsets[n]:self.leaf_offsets[n + 1]] for n in nodes])
+
+    def route(self, query_vector: np.ndarray, beams: Tuple[int, ...]) -> np.ndarray:
+        """Ids of the last-level nodes kept by the beam search."""
+        if len(beams) != len(self.levels):
+            raise ValueError(f"Expected {len(self.levels)} beam widths, got {len(beams)}")
+
+        candidates = np.arange(len(self.levels[0]["codes"]))
+        for depth, (level, beam) in enumerate(zip(self.levels, beams)):
+            scores = level["vectors"][candidates] @ query_vector
+            keep = candidates[np.argsort(-scores, kind="stable")[:beam]]
+            if depth + 1 == len(self.levels):
+                return keep
+            candidates = np.flatnonzero(np.isin(self.levels[depth + 1]["parent"], keep))
+
+    def search_vectors(self, query_vectors: np.ndarray, top_k: int = 5, beams: Tuple[int, ...] = (4, 8)):
+        n = len(query_vectors)
+        idx = np.full((n, top_k), -1, dtype=np.int64)
+        scores = np.full((n, top_k), -np.inf, dtype=np.float32)
+
+        for i, q in enumerate(query_vectors):
+            rows = self.leaf_rows(self.route(q, beams))
+            row_scores = self.base.vectors[rows] @ q
+            k = min(top_k, len(rows))
+            best = np.argsort(-row_scores, kind="stable")[:k]
+            idx[i, :k] = rows[best]
+            scores[i, :k] = row_scores[best]
+
+        return idx, scores
+
+    def search(self, query: Union[str, List[str]], top_k: int = 5, beams: Tuple[int, ...] = (4, 8)) -> List[QueryResult]:
+        queries = [query] if isinstance(query, str) else list(query)
+        idx, scores = self.search_vectors(self.base.encode(queries), top_k, beams)
+        return self.base.to_results(queries, np.maximum(idx, 0), scores)
+
+
+def get_hierarchical_base(
+    base: VectorKnowledgeBase,
+    levels: Tuple[str, ...] = ("sezione", "divisione"),
+    path: str = LEVELS_PATH,
+    cache: bool = True,
+) -> HierarchicalKnowledgeBase:
+    df = pd.read_csv(path, dtype=str)
+    df["description"] = df["description"].fillna("").str.replace("\\n", "\n", regex=False)
+    section_of = dict(zip(df["code"], df["main"]))
+
+    def prefix_of(codes: pd.Series, level: str) -> pd.Series:
+        if PREFIX[level] is None:
+            return codes.str[:2].map(section_of)
+        return codes.str[:PREFIX[level]]
+
+    built = []
+    for level in levels:
+        nodes = df[df["level"] == level].reset_index(drop=True)
+        texts = expand_template(LEVEL_TEMPLATE, {"title": nodes["title"], "description": nodes["description"]}).tolist()
+        if cache:
+            level_path = path.replace(".csv", f"_{level}.csv")
+            vectors = EmbeddingCache(level_path, base.model_id).get(texts, batch_size=base.batch_size)
+        else:
+            vectors = base.encode(texts)
+
+        parent = None
+        if built:
+            parent_codes = pd.Index(built[-1]["codes"])
+            parent = parent_codes.get_indexer(prefix_of(nodes["code"], levels[len(built) - 1]))
+        built.append({"level": level, "codes": nodes["code"].to_numpy(), "vectors": vectors, "parent": parent})
+
+    leaf_codes = base.code_table["code"].iloc[base.code_ids]
+    leaf_parent = pd.Index(built[-1]["codes"]).get_indexer(prefix_of(leaf_codes.reset_index(drop=True), levels[-1]))
+    return HierarchicalKnowledgeBase(base, built, leaf_parent)
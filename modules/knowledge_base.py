@@ -1,39 +1,85 @@
+import os
+import tempfile
 import pandas as pd
 import numpy as np
 from typing import List
-from semantic_search.data import build_corpus
-from semantic_search.local import LocalKnowledgeBase
+from modules.artifact import CODE_COLUMNS, Artifact, get_artifact
+from modules.embeddings import EmbeddingCache, encode, text_hash
+from modules.ann import IVFIndex
+from modules.quantization import quantize
+from modules.metrics import timed
+from modules.metadata import MetadataStore
+from modules.search import VectorKnowledgeBase
+
+def get_base(path: str, model_id: str, cache: bool = True, batch_size: int = 64,
+             index: str = "flat", n_lists: int = None, n_probe: int = 8,
+             quantization: str = None, rescore: int = 4, workers: int = 1) -> VectorKnowledgeBase:
+    artifact = get_artifact(path) if path.endswith(".csv") else Artifact(path)
+    texts = artifact.strings("leaf.text")
+    code_ids = np.asarray(artifact.array("leaf.code_id"))
+    metadata = MetadataStore(code_ids, artifact.frame("codes", CODE_COLUMNS))
+
+    embedding_cache = EmbeddingCache(path, model_id)
+    vectors = artifact.vectors(model_id) if cache else None
+    if vectors is None and cache:
+        vectors = embedding_cache.get(texts.tolist(), batch_size=batch_size, workers=workers)
+    elif vectors is None:
+        vectors = encode(texts.tolist(), model_id, batch_size, workers)
+
+    ann = None
+    if index == "ivf":
+        ann = get_ivf_index(embedding_cache.vectors_path.replace(".vectors.npy", ".ivf.npz"), texts.tolist(), vectors, n_lists, n_probe)
+    elif index != "flat":
+        raise ValueError(f"Unknown index type: {index}")
+
+    if quantization is not None:
+        if ann is not None:
+            raise ValueError("Quantized storage is only supported with the flat index")
+        ann = quantize(vectors, quantization, rescore=rescore)
+        # only the re-scored rows are read from here on
+        vectors = remap_vectors(vectors)
+
+    return VectorKnowledgeBase(
+        texts=texts,
+        metadata=metadata,
+        vectors=vectors,
+        model_id=model_id,
+        batch_size=batch_size,
+        index=ann
+    )
 
-def get_base(path: str, model_id: str) -> LocalKnowledgeBase:
-    df = pd.read_csv(path)
 
-    codes, texts, titles, descs, activities = [], [], [], [], []
-    for idx, row in df.iterrows():
-        desc = row["descriptor"]
-        desc_list = split_descriptor(desc) if type(desc) == str else []
+def remap_vectors(vectors: np.ndarray) -> np.memmap:
+    """A fresh read-only memory map of `vectors`: of the same file when they
+    are mapped already, of an unlinked temporary file when they are in RAM.
+    Pages touched so far (e.g. to build a quantized store) leave the process
+    with the old array, so only the rows read afterwards take memory."""
+    if isinstance(vectors, np.memmap) and vectors.filename:
+        return np.memmap(vectors.filename, dtype=vectors.dtype, mode="r", offset=vectors.offset, shape=vectors.shape)
 
-        descriptor_template = "#{title}\n{content}.\n\nPercorso: {hierarchy}"
+    with tempfile.NamedTemporaryFile(suffix=".npy", delete=False) as f:
+        path = f.name
+    try:
+        spilled = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=vectors.shape)
+        spilled[:] = vectors
+        spilled.flush()
+        del spilled
+        return np.load(path, mmap_mode="r")
+    finally:
+        os.unlink(path)
 
-        descriptors = [descriptor_template.format(title=row["title"], content=d, hierarchy=row["hierarchy"]) for d in desc_list]
-        texts.extend(descriptors)
 
-        for d in desc_list:
-            codes.append(row["code"])
-            titles.append(row["title"])
-            descs.append(row["descriptor"])
-            activities.append(row["activity"])
-    
-    corpus = build_corpus(
-        texts=texts,
-        ids=list(range(len(texts))),
-        metadata=[{"code": c, "title": t, "description": d, "activity": a} for c, t, d, a in zip(codes, titles, descs, activities)]
-    )
+def get_ivf_index(path: str, texts: List[str], vectors: np.ndarray, n_lists: int = None, n_probe: int = 8) -> IVFIndex:
+    fingerprint = text_hash(f"{n_lists}\n" + "\n".join(texts))
+    if os.path.exists(path):
+        ann = IVFIndex.load(path, n_probe)
+        if ann.fingerprint == fingerprint:
+            return ann
 
-    return LocalKnowledgeBase(
-        corpus=corpus,
-        model_id=model_id,
-        batch_size=64
-    )
+    ann = IVFIndex.build(vectors, n_lists=n_lists, fingerprint=fingerprint)
+    ann.n_probe = n_probe
+    ann.save(path)
+    return ann
 
 
 def split_descriptor(text: str) -> List[str]:
@@ -64,31 +110,89 @@ def split_descriptor(text: str) -> List[str]:
     
     return items
 
-def parse_retrieved(results):
-    codes = [r.metadata["code"] for r in results[0]]
-    titles = [r.metadata["title"] for r in results[0]]
-    descriptions = [r.metadata["description"] for r in results[0]]
-    activities = [r.metadata["activity"] for r in results[0]]
-    texts = [r.text for r in results[0]]
-    scores = [r.score for r in results[0]]
-
-    df = pd.DataFrame({
-        "code": codes,
-        "title": titles,
-        "matched_text": texts,
-        "description": descriptions,
-        "activity": activities,
-        "score": scores
-    })
-
-    grouped_df = df.groupby("code").aggregate({
-        "title": lambda x: np.unique(x)[0],
-        "description": lambda x: np.unique(x)[0],
-        "activity": lambda x: np.unique(x)[0],
-        "score": "max",
-    }).reset_index()
-
-    return grouped_df.sort_values("score", ascending=False)
+def aggregate_codes(code_ids: np.ndarray, scores: np.ndarray, top_k: int = None):
+    """Max score per code for each row of (N, k) chunk hits.
+
+    Returns (N, m) arrays of code ids and scores sorted by descending score,
+    padded with -1 / NaN where a row has fewer than m distinct codes.
+    """
+    code_ids = np.atleast_2d(code_ids)
+    scores = np.atleast_2d(scores).astype(np.float32)
+    n, k = code_ids.shape
+
+    by_score = np.argsort(-scores, axis=1, kind="stable")
+    code_ids = np.take_along_axis(code_ids, by_score, axis=1)
+    scores = np.take_along_axis(scores, by_score, axis=1)
+
+    # stable sort by code keeps each code's best hit first in its run
+    by_code = np.argsort(code_ids, axis=1, kind="stable")
+    sorted_codes = np.take_along_axis(code_ids, by_code, axis=1)
+    first = np.ones((n, k), dtype=bool)
+    first[:, 1:] = sorted_codes[:, 1:] != sorted_codes[:, :-1]
+
+    keep = np.zeros((n, k), dtype=bool)
+    np.put_along_axis(keep, by_code, first, axis=1)
+
+    ranked_scores = np.where(keep, scores, -np.inf)
+    order = np.argsort(-ranked_scores, axis=1, kind="stable")
+    m = int(keep.sum(axis=1).max()) if n else 0
+    if top_k is not None:
+        m = min(m, top_k)
+    order = order[:, :m]
+
+    out_codes = np.take_along_axis(code_ids, order, axis=1)
+    out_scores = np.take_along_axis(ranked_scores, order, axis=1)
+    valid = np.isfinite(out_scores)
+    return np.where(valid, out_codes, -1), np.where(valid, out_scores, np.nan)
+
+
+def hit_arrays(results, base: VectorKnowledgeBase):
+    """(N, k) code ids and scores of the hits; results with fewer hits than
+    the longest one (e.g. from an IVF probe with few rows) are padded with
+    code id -1 and score -inf."""
+    width = max((len(result) for result in results), default=0)
+    code_ids = np.full((len(results), width), -1, dtype=np.int64)
+    scores = np.full((len(results), width), -np.inf, dtype=np.float32)
+    for i, result in enumerate(results):
+        if len(result):
+            code_ids[i, :len(result)] = [hit.code_id for hit in result]
+            scores[i, :len(result)] = [hit.score for hit in result]
+    return code_ids, scores
+
+
+def codes_frame(code_table: pd.DataFrame, code_ids: np.ndarray, scores: np.ndarray) -> pd.DataFrame:
+    valid = code_ids >= 0
+    df = code_table.iloc[code_ids[valid]].reset_index(drop=True)
+    df["score"] = scores[valid]
+    return df
+
+
+def parse_retrieved_batch(results, base: VectorKnowledgeBase, top_k: int = None, as_frame: bool = False):
+    """Rank codes for every query of a batch search.
+
+    With `as_frame=False` returns the (N, m) code id / score arrays of
+    `aggregate_codes`, to be resolved against `base.code_table`; otherwise
+    one DataFrame per query, as `parse_retrieved`.
+    """
+    code_ids, scores = aggregate_codes(*hit_arrays(results, base), top_k=top_k)
+    if not as_frame:
+        return code_ids, scores
+    return [codes_frame(base.code_table, c, s) for c, s in zip(code_ids, scores)]
+
+
+@timed("parse_retrieved")
+def parse_retrieved(results, base: VectorKnowledgeBase = None, top_k: int = None) -> pd.DataFrame:
+    if base is not None and base.code_ids is not None:
+        return parse_retrieved_batch(results[:1], base, top_k=top_k, as_frame=True)[0]
+
+    hits = results[0]
+    codes, code_ids = np.unique([r.metadata["code"] for r in hits], return_inverse=True)
+    first = np.unique(code_ids, return_index=True)[1]
+    code_table = pd.DataFrame([
+        {key: hits[i].metadata[key] for key in ("code", "title", "description", "activity")} for i in first
+    ])
+    ranked_ids, ranked_scores = aggregate_codes(code_ids, np.array([r.score for r in hits]), top_k=top_k)
+    return codes_frame(code_table, ranked_ids[0], ranked_scores[0])
 
 def parse_description(text: str) -> str:
     texts = text.split("\n\n")
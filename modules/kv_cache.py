@@ -0,0 +1,92 @@
+import copy
+import threading
+from collections import OrderedDict
+
+
+def cache_nbytes(cache) -> int:
+    layers = getattr(cache, "layers", None)
+    if layers is not None:
+        return sum(layer.keys.nbytes + layer.values.nbytes for layer in layers if getattr(layer, "keys", None) is not None)
+    return sum(k.nbytes + v.nbytes for k, v in zip(cache.key_cache, cache.value_cache))
+
+
+def common_prefix(a, b) -> int:
+    n = min(len(a), len(b))
+    if n == 0:
+        return 0
+    diff = (a[:n] != b[:n]).nonzero()
+    return int(diff[0]) if len(diff) else n
+
+
+class PrefixCache:
+    """Past key/values of token prefixes, for reuse across generate calls.
+
+    Pinned entries (the system prompt) are kept for the life of the process;
+    session entries hold the last prompt + answer of a conversation and are
+    evicted least-recently-used first once `max_bytes` is exceeded.
+    """
+
+    def __init__(self, max_bytes: int = 2 * 1024 ** 3):
+        self.max_bytes = max_bytes
+        self.pinned = {}
+        self.sessions = OrderedDict()
+        self.prefill_tokens = 0
+        self.reused_tokens = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return sum(e["bytes"] for e in list(self.pinned.values()) + list(self.sessions.values()))
+
+    def pin(self, key, ids, cache):
+        with self._lock:
+            self.pinned[key] = {"ids": ids, "cache": cache, "bytes": cache_nbytes(cache)}
+
+    def put(self, session_id, ids, cache):
+        with self._lock:
+            self.sessions[session_id] = {"ids": ids, "cache": cache, "bytes": cache_nbytes(cache)}
+            self.sessions.move_to_end(session_id)
+            while self.sessions and self.nbytes > self.max_bytes:
+                self.sessions.popitem(last=False)
+
+    def drop(self, session_id):
+        with self._lock:
+            self.sessions.pop(session_id, None)
+
+    def match(self, ids, session_id=None):
+        """A private copy of the longest cached prefix of `ids`, cropped to
+        leave at least one token to prefill, and its length."""
+        with self._lock:
+            candidates = list(self.pinned.values())
+            if session_id in self.sessions:
+                self.sessions.move_to_end(session_id)
+                candidates.append(self.sessions[session_id])
+
+            best, length = None, 0
+            for entry in candidates:
+                n = common_prefix(entry["ids"], ids)
+                if n > length:
+                    best, length = entry, n
+
+            length = min(length, len(ids) - 1)
+            if best is None or length <= 0:
+                return None, 0
+
+            cache = copy.deepcopy(best["cache"])
+        cache.crop(length)
+        return cache, length
+
+    def record(self, prompt_tokens: int, reused: int):
+        with self._lock:
+            self.prefill_tokens += prompt_tokens - reused
+            self.reused_tokens += reused
+
+    def stats(self) -> dict:
+        return {
+            "pinned": len(self.pinned),
+            "sessions": len(self.sessions),
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "prefill_tokens": self.prefill_tokens,
+            "reused_tokens": self.reused_tokens,
+        }
@@ -0,0 +1,231 @@
+import re
+import numpy as np
+import pandas as pd
+from collections import defaultdict
+from typing import Dict, List
+from modules.artifact import get_artifact
+from modules.query_cache import normalize_query
+from modules.knowledge_base import aggregate_codes, parse_retrieved
+
+STOPWORDS = frozenset("""
+a ad al alla alle allo agli ai anche c che chi con col coi da dal dalla dalle dallo dagli dai del della delle dello
+degli dei di e ed gli i il in l la le lo ma ne negli nei nel nella nelle nello o od per piu pero quale quali
+questo questa se senza si sia sono su sul sulla sulle sullo sugli sui tra fra un una uno
+all dall dell nell sull srl spa snc sas
+""".split())
+
+BRACKETS = re.compile(r"\[[^\]]*\]")
+
+INDEX_FIELDS = ["ELEMENTO_IT", "ATTIVITA_IT", "COMBO_PARLATA_IT"]
+EXACT_FIELDS = ["COMBO_PARLATA_IT", "COMBO_DIRETTA_IT", "IT_INDEX_CLEAN"]
+
+
+def stem(token: str) -> str:
+    """Drops the final vowel of longer words, so singular and plural forms
+    ("bevanda", "bevande") share a token."""
+    return token[:-1] if len(token) > 4 and token[-1] in "aeio" else token
+
+
+def tokenize(text: str) -> List[str]:
+    """Accent-folded, lower-cased, stemmed content words of an Italian text."""
+    text = BRACKETS.sub(" ", str(text))
+    return [stem(t) for t in normalize_query(text).split() if t not in STOPWORDS and len(t) > 1]
+
+
+def exact_key(text: str) -> str:
+    return " ".join(sorted(set(tokenize(text))))
+
+
+class LexicalIndex:
+    """BM25 inverted index over the curated ATECO 2025 index entries.
+
+    Postings are stored as flat arrays with the BM25 weight of each
+    (token, entry) pair precomputed, so scoring a query is one vector add per
+    query token. `exact` maps the order-insensitive content words of the
+    combined index phrases to their code when that code is unique.
+    """
+
+    def __init__(self, texts: List[str], codes: List[str], exact: dict, k1: float = 1.2, b: float = 0.75):
+        self.texts = texts
+        self.code_ids, self.codes = pd.factorize(pd.Series(codes))
+        self.code_ids = self.code_ids.astype(np.int32)
+        self.exact = exact
+
+        docs = [tokenize(t) for t in texts]
+        lengths = np.array([len(d) for d in docs], dtype=np.float32)
+        avg_length = lengths.mean() if len(lengths) else 0.0
+
+        tf = defaultdict(lambda: defaultdict(int))
+        for doc_id, tokens in enumerate(docs):
+            for token in tokens:
+                tf[token][doc_id] += 1
+
+        self.postings = {}
+        n = len(docs)
+        for token, counts in tf.items():
+            doc_ids = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+            freqs = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+            idf = np.log1p((n - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            norm = k1 * (1 - b + b * lengths[doc_ids] / avg_length)
+            self.postings[token] = (doc_ids, (idf * freqs * (k1 + 1) / (freqs + norm)).astype(np.float32))
+
+    def __len__(self):
+        return len(self.texts)
+
+    def lookup(self, query: str):
+        return self.exact.get(exact_key(query))
+
+    def scores(self, query: str):
+        """BM25 score of every entry and the share of query tokens it contains."""
+        tokens = set(tokenize(query))
+        scores = np.zeros(len(self.texts), dtype=np.float32)
+        matched = np.zeros(len(self.texts), dtype=np.int32)
+        for token in tokens:
+            if token in self.postings:
+                doc_ids, weights = self.postings[token]
+                scores[doc_ids] += weights
+                matched[doc_ids] += 1
+        return scores, matched / max(len(tokens), 1)
+
+    def search(self, query: str, top_k: int = 5, search_k: int = 50):
+        """Top codes by max BM25 score of their entries, as (codes, scores, coverage).
+
+        `coverage` is the share of query tokens found in the best entry.
+        """
+        scores, coverage = self.scores(query)
+        k = min(search_k, len(scores))
+        idx = np.argpartition(-scores, k - 1)[:k]
+        idx = idx[scores[idx] > 0]
+        if not len(idx):
+            return np.array([], dtype=object), np.array([], dtype=np.float32), 0.0
+
+        code_ids, code_scores = aggregate_codes(self.code_ids[idx][None, :], scores[idx][None, :], top_k=top_k)
+        valid = code_ids[0] >= 0
+        return self.codes[code_ids[0][valid]].to_numpy(), code_scores[0][valid], float(coverage[idx[np.argmax(scores[idx])]])
+
+
+def leaf_codes(codes: pd.Series, leaf: List[str]) -> pd.Series:
+    """Each code if it is a leaf code, else the one leaf code sharing its
+    longest prefix (at least the class, "47.11"), e.g. "08.93.01" ->
+    "08.93.00"; NaN when there is none or several ("14.24.00" has both
+    "14.24.10" and "14.24.20")."""
+    leaf_set = set(leaf)
+
+    def match(code: str):
+        if code in leaf_set:
+            return code
+        for length in range(len(code) - 1, 4, -1):
+            found = [c for c in leaf if c.startswith(code[:length])]
+            if found:
+                return found[0] if len(found) == 1 else np.nan
+        return np.nan
+
+    return codes.map({c: match(c) for c in codes.unique()})
+
+
+def build_lexical_index(path: str = "classification/ateco_2025/ateco_2025_index.csv", leaf_path: str = "data/ateco_2025_leaf.csv") -> LexicalIndex:
+    """Index entries of `path` mapped onto the codes of the leaf corpus (see
+    `leaf_codes`; entries without a leaf code are dropped), plus the leaf
+    titles and descriptor items, so every answer is a code of the dense base."""
+    artifact = get_artifact(leaf_path)
+    leaf = artifact.strings("codes.code").tolist()
+    titles = artifact.strings("codes.title").tolist()
+    item_codes = np.asarray(leaf, dtype=object)[np.asarray(artifact.array("descriptors.code_id"))]
+    items = artifact.strings("descriptors.item").tolist()
+
+    df = pd.read_csv(path, dtype=str).fillna("")
+    df["ATECO2025"] = leaf_codes(df["ATECO2025"], leaf)
+    df = df.dropna(subset=["ATECO2025"])
+    texts = df[INDEX_FIELDS].agg(" ".join, axis=1).tolist() + titles + items
+    codes = df["ATECO2025"].tolist() + leaf + item_codes.tolist()
+
+    keys = pd.concat([
+        pd.DataFrame({"key": df[field].map(exact_key), "code": df["ATECO2025"]}) for field in EXACT_FIELDS
+    ] + [pd.DataFrame({"key": [exact_key(t) for t in titles + items], "code": leaf + item_codes.tolist()})]).drop_duplicates()
+    keys = keys[keys["key"] != ""]
+    unique = keys.groupby("key")["code"].transform("size") == 1
+    exact: Dict[str, str] = dict(zip(keys.loc[unique, "key"], keys.loc[unique, "code"]))
+
+    return LexicalIndex(texts=texts, codes=codes, exact=exact)
+
+
+class HybridKnowledgeBase:
+    """Lexical-first classifier with dense fallback.
+
+    Exact index phrases, and lexical matches that cover every query word
+    and whose best code beats the runner-up by `margin`, are answered from
+    the inverted index alone. Anything else is searched with the dense base
+    as well and the two code rankings are merged with reciprocal rank fusion.
+
+    `score` is the cosine similarity of the dense base wherever there is
+    one; rows answered from the index alone carry their BM25 score relative
+    to the best code in `lexical_score` instead, and `source` says which
+    path produced a row.
+    """
+
+    def __init__(self, base, index: LexicalIndex, margin: float = 1.1, rrf_k: int = 60):
+        self.base = base
+        self.index = index
+        self.margin = margin
+        self.rrf_k = rrf_k
+        self.lexical_answers = 0
+        self.dense_answers = 0
+
+    def __getattr__(self, name):
+        return getattr(self.base, name)
+
+    def frame(self, codes, scores, source: str, lexical_scores=np.nan) -> pd.DataFrame:
+        df = pd.DataFrame({"code": codes, "score": scores, "lexical_score": lexical_scores, "source": source})
+        return df.merge(self.base.code_table, on="code", how="left")[
+            ["code", "title", "description", "activity", "score", "lexical_score", "source"]
+        ]
+
+    def rrf(self, rankings, top_k: int):
+        """The `top_k` codes of several code rankings by reciprocal rank
+        fusion, and their fused scores."""
+        fused = defaultdict(float)
+        for ranking in rankings:
+            for rank, code in enumerate(ranking):
+                fused[code] += 1 / (self.rrf_k + rank + 1)
+        codes = sorted(fused, key=fused.get, reverse=True)[:top_k]
+        return codes, [fused[c] for c in codes]
+
+    def fuse(self, dense: pd.DataFrame, lexical_codes, top_k: int) -> pd.DataFrame:
+        codes, fused = self.rrf([dense["code"], lexical_codes], top_k)
+        dense_scores = dict(zip(dense["code"], dense["score"]))
+        df = self.frame(codes, [dense_scores.get(c, np.nan) for c in codes], "hybrid")
+        df["fused"] = fused
+        return df
+
+    def lexical(self, query: str, top_k: int = 5):
+        """(codes, scores, source) when the index alone is confident, else None."""
+        code = self.index.lookup(query)
+        if code is not None:
+            self.lexical_answers += 1
+            return np.array([code], dtype=object), np.ones(1, dtype=np.float32), "exact"
+
+        codes, scores, coverage = self.index.search(query, top_k=top_k)
+        confident = len(scores) == 1 or (len(scores) > 1 and scores[0] >= self.margin * scores[1])
+        if coverage == 1.0 and confident:
+            self.lexical_answers += 1
+            return codes, scores / scores[0], "lexical"
+        self.dense_answers += 1
+        return None
+
+    def classify(self, query: str, top_k: int = 5, search_k: int = 30) -> pd.DataFrame:
+        answer = self.lexical(query, top_k)
+        if answer is not None:
+            codes, lexical_scores, source = answer
+            return self.frame(codes, np.nan, source, lexical_scores)
+
+        lexical_codes, _, _ = self.index.search(query, top_k=top_k)
+        dense = parse_retrieved(self.base.search(query, top_k=search_k), self.base)
+        return self.fuse(dense, lexical_codes, top_k)
+
+    def stats(self) -> dict:
+        total = self.lexical_answers + self.dense_answers
+        return {
+            "lexical": self.lexical_answers,
+            "dense": self.dense_answers,
+            "lexical_rate": self.lexical_answers / total if total else 0.0,
+        }
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+from collections.abc import Mapping
+
+
+class CodeRecord(Mapping):
+    """Read-only view of one code's metadata; fields are looked up in the
+    store's columns when accessed."""
+
+    __slots__ = ("store", "code_id")
+
+    def __init__(self, store: "MetadataStore", code_id: int):
+        self.store = store
+        self.code_id = code_id
+
+    def __getitem__(self, key):
+        return self.store.columns[key][self.code_id]
+
+    def __iter__(self):
+        return iter(self.store.columns)
+
+    def __len__(self):
+        return len(self.store.columns)
+
+    def __repr__(self):
+        return f"CodeRecord({dict(self)})"
+
+
+class MetadataStore:
+    """Columnar metadata of a multi-vector corpus.
+
+    Every chunk stores only the row of its code in `frame` (`code_ids`); the
+    per-code fields are held once per code, so a code with 20 descriptor
+    chunks keeps a single copy of its description. `store[i]` is the
+    `CodeRecord` of chunk `i`, which lets the store stand in for the list of
+    per-chunk dicts `VectorKnowledgeBase` used to take.
+    """
+
+    def __init__(self, code_ids: np.ndarray, frame: pd.DataFrame):
+        self.code_ids = np.asarray(code_ids, dtype=np.int32)
+        self.frame = frame.reset_index(drop=True)
+        self.columns = {c: self.frame[c].to_numpy() for c in self.frame.columns}
+
+    @classmethod
+    def from_codes(cls, codes, **columns) -> "MetadataStore":
+        """Factorizes per-chunk `codes`; `columns` are per-chunk too and keep
+        the value of each code's first chunk."""
+        code_ids, uniques = pd.factorize(pd.Series(codes))
+        first = np.unique(code_ids, return_index=True)[1]
+        frame = pd.DataFrame({"code": uniques, **{c: np.asarray(v, dtype=object)[first] for c, v in columns.items()}})
+        return cls(code_ids, frame)
+
+    def __len__(self):
+        return len(self.code_ids)
+
+    def __getitem__(self, i: int) -> CodeRecord:
+        return CodeRecord(self, int(self.code_ids[i]))
+
+    @property
+    def n_codes(self) -> int:
+        return len(self.frame)
+
+    def field(self, name: str, code_ids: np.ndarray) -> np.ndarray:
+        return self.columns[name][code_ids]
+
+    def nbytes(self) -> int:
+        return int(self.code_ids.nbytes + self.frame.memory_usage(index=False, deep=True).sum())
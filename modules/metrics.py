@@ -0,0 +1,208 @@
+"""Timings, counters and gauges of the classification hot path.
+
+Stages are timed with the `timed` decorator or the `METRICS.timer` context
+manager; both reduce to one attribute check while metrics are disabled.
+Set `ATECO_METRICS=1` to enable them and `ATECO_METRICS_PORT` to serve
+`/metrics` (Prometheus text format) and `/metrics.json` from a background
+thread; `metrics_panel` shows the same numbers in the Streamlit sidebar.
+"""
+import os
+import json
+import time
+import threading
+import functools
+import numpy as np
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Reservoir:
+    """Count and sum of all observations, plus the last `window` values for
+    percentiles."""
+
+    def __init__(self, window: int = 2048):
+        self.values = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value: float):
+        self.values.append(value)
+        self.count += 1
+        self.sum += value
+
+    def summary(self) -> dict:
+        values = np.fromiter(list(self.values), dtype=np.float64)
+        quantiles = np.quantile(values, QUANTILES) if len(values) else [float("nan")] * len(QUANTILES)
+        return {"count": self.count, "sum": self.sum, **{f"p{int(q * 100)}": float(v) for q, v in zip(QUANTILES, quantiles)}}
+
+
+class Metrics:
+    def __init__(self, enabled: bool = False, window: int = 2048):
+        self.enabled = enabled
+        self.window = window
+        self.timings = {}
+        self.values = {}
+        self.counters = {}
+        self.collectors = {}
+        self._lock = threading.Lock()
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+
+    def _observe(self, family: dict, name: str, value: float):
+        with self._lock:
+            if name not in family:
+                family[name] = Reservoir(self.window)
+            family[name].add(value)
+
+    def observe_time(self, stage: str, seconds: float):
+        if self.enabled:
+            self._observe(self.timings, stage, seconds)
+
+    def observe(self, name: str, value: float):
+        if self.enabled:
+            self._observe(self.values, name, value)
+
+    def inc(self, name: str, value: float = 1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def _timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_time(stage, time.perf_counter() - start)
+
+    def timer(self, stage: str):
+        return self._timer(stage) if self.enabled else nullcontext()
+
+    def register(self, name: str, collector):
+        """`collector()` returns a (nested) dict whose numeric leaves are
+        exported as gauges, e.g. `CachedKnowledgeBase.stats`."""
+        self.collectors[name] = collector
+
+    def gauges(self) -> dict:
+        out = {}
+
+        def flatten(prefix, value):
+            if isinstance(value, dict):
+                for key, item in value.items():
+                    flatten(f"{prefix}_{key}", item)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                out[prefix] = float(value)
+
+        for name, collector in list(self.collectors.items()):
+            flatten(name, collector())
+        return out
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            timings = {name: r.summary() for name, r in self.timings.items()}
+            values = {name: r.summary() for name, r in self.values.items()}
+            counters = dict(self.counters)
+        return {"timings": timings, "values": values, "counters": counters, "gauges": self.gauges()}
+
+    def to_prometheus(self, prefix: str = "ateco") -> str:
+        snapshot = self.snapshot()
+        lines = [f"# TYPE {prefix}_stage_seconds summary"]
+        for stage, s in snapshot["timings"].items():
+            for q in QUANTILES:
+                lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="{q}"}} {s[f"p{int(q * 100)}"]}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {s["count"]}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {s["sum"]}')
+        for name, s in snapshot["values"].items():
+            lines.append(f"# TYPE {prefix}_{name} summary")
+            for q in QUANTILES:
+                lines.append(f'{prefix}_{name}{{quantile="{q}"}} {s[f"p{int(q * 100)}"]}')
+            lines.append(f"{prefix}_{name}_count {s['count']}")
+            lines.append(f"{prefix}_{name}_sum {s['sum']}")
+        for name, value in snapshot["counters"].items():
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        for name, value in snapshot["gauges"].items():
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics(enabled=os.getenv("ATECO_METRICS", "") not in ("", "0"))
+
+
+def timed(stage: str):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not METRICS.enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                METRICS.observe_time(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = METRICS.to_prometheus(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = json.dumps(METRICS.snapshot()), "application/json"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve(port: int = None) -> ThreadingHTTPServer:
+    """Starts the metrics endpoint once per process; `port` defaults to
+    `ATECO_METRICS_PORT` and nothing is started when neither is set."""
+    global _server
+    port = port or int(os.getenv("ATECO_METRICS_PORT", 0))
+    with _server_lock:
+        if _server is None and port:
+            _server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
+
+
+def metrics_panel():
+    """Per-stage latency percentiles and cache hit rates in the sidebar."""
+    import pandas as pd
+    import streamlit as st
+
+    if not METRICS.enabled:
+        return
+
+    snapshot = METRICS.snapshot()
+    with st.sidebar.expander("Metriche", expanded=False):
+        if snapshot["timings"]:
+            st.markdown("**Tempi per fase (ms)**")
+            st.dataframe(pd.DataFrame([
+                {"fase": stage, "n": s["count"], **{p: s[p] * 1000 for p in ("p50", "p95", "p99")}}
+                for stage, s in snapshot["timings"].items()
+            ]).round(2), hide_index=True)
+        for name, s in snapshot["values"].items():
+            st.metric(name, f"{s['p50']:.1f}", help=f"p50 su {s['count']} osservazioni")
+        for name, value in snapshot["gauges"].items():
+            if name.endswith("hit_rate"):
+                st.metric(name, f"{value:.1%}")
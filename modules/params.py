@@ -44,6 +44,8 @@ MODELS = {
 
 LLM = {
     "model_id": "meta-llama/Llama-3.2-3B-Instruct",
+    # seconds a request may wait for the model before it is turned away
+    "ttft_target": 10.0,
 
     "system_prompt": """Sei un assistente per la classificazione di imprese italiane in attività aconomiche (ATECO 2025) partendo da una breve descrizione della loro attività.
     
@@ -1,5 +1,7 @@
 import plotly.graph_objects as go
+from modules.metrics import timed
 
+@timed("plot_scores")
 def plot_scores(data, height=100):
     codes = data["code"].tolist()[::-1]
     texts = data["title"].tolist()[::-1]
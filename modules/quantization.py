@@ -0,0 +1,152 @@
+import numpy as np
+
+BLOCK = 16_384
+# rows converted to float32 at a time when scoring: 12 MiB at 3072 dims
+SCORE_BLOCK = 1024
+
+
+def blockwise(query_vectors: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """`query_vectors @ codes.T` in float32, converting `SCORE_BLOCK` rows of
+    the stored codes at a time."""
+    out = np.empty((len(query_vectors), len(codes)), dtype=np.float32)
+    for start in range(0, len(codes), SCORE_BLOCK):
+        np.matmul(query_vectors, codes[start:start + SCORE_BLOCK].astype(np.float32).T, out=out[:, start:start + SCORE_BLOCK])
+    return out
+
+
+class Float16Store:
+    def __init__(self, vectors: np.ndarray):
+        self.codes = np.asarray(vectors, dtype=np.float16)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes
+
+    def score(self, query_vectors: np.ndarray) -> np.ndarray:
+        return blockwise(query_vectors, self.codes)
+
+
+class Int8Store:
+    """Per-dimension scalar quantization to int8 (min/max range, 256 levels)."""
+
+    def __init__(self, vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.low = vectors.min(axis=0)
+        self.scale = np.maximum(vectors.max(axis=0) - self.low, 1e-12) / 255
+        self.codes = (np.round((vectors - self.low) / self.scale) - 128).astype(np.int8)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.low.nbytes + self.scale.nbytes
+
+    def score(self, query_vectors: np.ndarray) -> np.ndarray:
+        # x ~ low + (code + 128) * scale  =>  q.x ~ q.low + 128 q.scale + (q * scale).code
+        weighted = query_vectors * self.scale
+        offset = query_vectors @ self.low + 128 * weighted.sum(axis=1)
+        scores = blockwise(weighted, self.codes)
+        scores += offset[:, None]
+        return scores
+
+
+class PQStore:
+    """Product quantization: `n_subspaces` codebooks of 256 centroids each,
+    scored with per-query inner-product lookup tables."""
+
+    def __init__(self, vectors: np.ndarray, n_subspaces: int = 64, iterations: int = 10, train_size: int = 50_000, seed: int = 0):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        n, dim = vectors.shape
+        if dim % n_subspaces:
+            raise ValueError(f"Vector size {dim} is not divisible by {n_subspaces} subspaces")
+
+        self.n_subspaces = n_subspaces
+        self.sub_dim = dim // n_subspaces
+        rng = np.random.default_rng(seed)
+        train = vectors[rng.choice(n, min(n, train_size), replace=False)]
+        n_centroids = min(256, len(train))
+
+        self.codebooks = np.empty((n_subspaces, n_centroids, self.sub_dim), dtype=np.float32)
+        self.codes = np.empty((n, n_subspaces), dtype=np.uint8)
+        for j in range(n_subspaces):
+            sub = slice(j * self.sub_dim, (j + 1) * self.sub_dim)
+            self.codebooks[j] = euclidean_kmeans(train[:, sub], n_centroids, iterations, rng)
+            for start in range(0, n, BLOCK):
+                self.codes[start:start + BLOCK, j] = nearest(vectors[start:start + BLOCK, sub], self.codebooks[j])
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.codebooks.nbytes
+
+    def score(self, query_vectors: np.ndarray) -> np.ndarray:
+        subqueries = query_vectors.reshape(len(query_vectors), self.n_subspaces, self.sub_dim)
+        tables = np.einsum("qjd,jcd->qjc", subqueries, self.codebooks)
+        scores = np.zeros((len(query_vectors), len(self.codes)), dtype=np.float32)
+        for j in range(self.n_subspaces):
+            scores += tables[:, j, self.codes[:, j]]
+        return scores
+
+
+def nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    distances = (vectors ** 2).sum(axis=1)[:, None] - 2 * vectors @ centroids.T + (centroids ** 2).sum(axis=1)[None, :]
+    return np.argmin(distances, axis=1)
+
+
+def euclidean_kmeans(vectors: np.ndarray, n_clusters: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        labels = nearest(vectors, centroids)
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+STORES = {"float16": Float16Store, "int8": Int8Store, "pq": PQStore}
+
+
+class QuantizedIndex:
+    """Scores all vectors from a compact store, then re-scores the best
+    `rescore * top_k` candidates against the full-precision vectors.
+
+    The full-precision matrix passed to `search` can be the memory-mapped
+    embedding cache, so only the re-scored rows are ever read from disk.
+    """
+
+    def __init__(self, store, rescore: int = 4):
+        self.store = store
+        self.rescore = rescore
+
+    @property
+    def nbytes(self) -> int:
+        return self.store.nbytes
+
+    def search(self, vectors: np.ndarray, query_vectors: np.ndarray, top_k: int = 5):
+        approx = self.store.score(query_vectors)
+        n_candidates = min(max(top_k, self.rescore * top_k), approx.shape[1])
+        candidates = np.argpartition(-approx, n_candidates - 1, axis=1)[:, :n_candidates]
+
+        if self.rescore:
+            scores = np.stack([np.asarray(vectors[np.sort(c)], dtype=np.float32) @ q for c, q in zip(candidates, query_vectors)])
+            candidates = np.sort(candidates, axis=1)
+        else:
+            scores = np.take_along_axis(approx, candidates, axis=1)
+
+        k = min(top_k, n_candidates)
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+def quantize(vectors: np.ndarray, method: str, rescore: int = 4, **kwargs) -> QuantizedIndex:
+    if method not in STORES:
+        raise ValueError(f"Unknown quantization: {method}. Choose one of {list(STORES)}")
+    return QuantizedIndex(STORES[method](vectors, **kwargs), rescore=rescore)
@@ -0,0 +1,137 @@
+import re
+import threading
+import unicodedata
+import numpy as np
+from collections import OrderedDict
+from typing import List, Union
+from modules.search import QueryResult, VectorKnowledgeBase
+
+NON_WORD = re.compile(r"[\W_]+")
+DOUBLED_INITIAL = re.compile(r"^(\w)\1+(?=\w{3,})")
+
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a free-text query.
+
+    Lower-cases, folds accents, turns apostrophes and punctuation into
+    spaces, collapses whitespace and collapses a repeated first letter
+    ("aagente" and "aaagente" -> "agente", "ccommercio" -> "commercio").
+    Idempotent, so a canonical form maps to itself.
+    """
+    text = unicodedata.normalize("NFKD", str(query).lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = NON_WORD.sub(" ", text).strip()
+    return DOUBLED_INITIAL.sub(r"\1", text)
+
+
+class LRUCache:
+    def __init__(self, max_size: int = 10_000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class CachedKnowledgeBase:
+    """Normalizing, de-duplicating, caching front for a `VectorKnowledgeBase`.
+
+    Queries are reduced to their canonical form, which is both the cache key
+    and the text the encoder sees, so every variant of a query ("Vendita
+    VINI", "vendita vini") gets the same embedding and hits whatever traffic
+    came before. Distinct forms are encoded once per batch, and embeddings
+    and ranked hits are kept in bounded LRU caches keyed by (model_id,
+    canonical query). Ranked hits
+    are also keyed by the base's `version`, if it has one, so writes to a
+    `SegmentedKnowledgeBase` are never answered from stale results. Other
+    attributes are forwarded to the wrapped base.
+    """
+
+    def __init__(self, base: VectorKnowledgeBase, max_embeddings: int = 50_000, max_results: int = 10_000):
+        self.base = base
+        self.embeddings = LRUCache(max_embeddings)
+        self.results = LRUCache(max_results)
+        self.deduplicated = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.base, name)
+
+    def __len__(self):
+        return len(self.base)
+
+    def encode(self, queries: List[str]) -> np.ndarray:
+        canonical = [normalize_query(q) for q in queries]
+        unique = list(dict.fromkeys(canonical))
+        with self._lock:
+            self.deduplicated += len(canonical) - len(unique)
+
+        vectors = {c: self.embeddings.get((self.base.model_id, c)) for c in unique}
+        missing = [c for c, v in vectors.items() if v is None]
+        if missing:
+            for c, v in zip(missing, self.base.encode(missing)):
+                self.embeddings.put((self.base.model_id, c), v)
+                vectors[c] = v
+
+        return np.stack([vectors[c] for c in canonical])
+
+    def search(self, query: Union[str, List[str]], top_k: int = 5) -> List[QueryResult]:
+        queries = [query] if isinstance(query, str) else list(query)
+        canonical = [normalize_query(q) for q in queries]
+        unique = list(dict.fromkeys(canonical))
+
+        # a segmented base answers from one snapshot, so the cached row ids
+        # and the hits resolve against the same rows
+        view = self.base.snapshot() if hasattr(self.base, "snapshot") else self.base
+        version = getattr(view, "version", 0)
+        ranked = {}
+        for c in unique:
+            cached = self.results.get((self.base.model_id, version, c, top_k))
+            if cached is not None:
+                ranked[c] = cached
+
+        missing = [c for c in unique if c not in ranked]
+        if missing:
+            idx, scores = view.search_vectors(self.encode(missing), top_k)
+            for c, i, s in zip(missing, idx, scores):
+                ranked[c] = (i, s)
+                self.results.put((self.base.model_id, version, c, top_k), (i, s))
+
+        idx = np.stack([ranked[c][0] for c in canonical])
+        scores = np.stack([ranked[c][1] for c in canonical])
+        return view.to_results(queries, idx, scores)
+
+    def stats(self) -> dict:
+        return {
+            "embeddings": self.embeddings.stats(),
+            "results": self.results.stats(),
+            "deduplicated": self.deduplicated,
+        }
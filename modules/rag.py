@@ -1,32 +1,35 @@
 import os
 import pandas as pd
 import numpy as np
-import torch
 import string
+import time
 from threading import Thread
-from typing import List
-from transformers import AutoTokenizer, AutoModelForCausalLM
-from transformers import TextIteratorStreamer
-from semantic_search.data import build_corpus
-from semantic_search.local import LocalKnowledgeBase
+from typing import List, TYPE_CHECKING
+from modules.corpus import expand_template, explode_descriptors, enumerate_descriptors
+from modules.kv_cache import PrefixCache
+from modules.metrics import METRICS
+
+if TYPE_CHECKING:
+    from semantic_search.local import LocalKnowledgeBase
+
+# torch, transformers and semantic_search are imported where they are used,
+# so that importing the prompt helpers stays cheap
 
 hf_token = os.getenv("HF_TOKEN")
 
-def build_kb(path: str, model_id: str) -> LocalKnowledgeBase:
+def build_kb(path: str, model_id: str) -> "LocalKnowledgeBase":
+    from semantic_search.data import build_corpus
+    from semantic_search.local import LocalKnowledgeBase
+
     DESCRIPTOR: bool = """{title}"""
 
     ateco_df = pd.read_csv(path)
 
-    descriptors = []
-    for idx, row in ateco_df.iterrows():
-        title = row["title"]
-        description = row["descriptor"]
-        if pd.isna(description):
-            description = ""
-        if pd.isna(title):
-            title = ""
-        descriptors.append(DESCRIPTOR.format(title=title, description=description))
-    
+    descriptors = expand_template(DESCRIPTOR, {
+        "title": ateco_df["title"].fillna(""),
+        "description": ateco_df["descriptor"].fillna(""),
+    }).tolist()
+
     corpus = build_corpus(
         texts=descriptors,
         ids=ateco_df.index,
@@ -39,27 +42,24 @@ def build_kb(path: str, model_id: str) -> LocalKnowledgeBase:
         batch_size=64
     )
 
-def build_multivector_kb(path: str, model_id: str) -> LocalKnowledgeBase:
+def build_multivector_kb(path: str, model_id: str) -> "LocalKnowledgeBase":
+    from semantic_search.data import build_corpus
+    from semantic_search.local import LocalKnowledgeBase
+
     df = pd.read_csv(path)
-    codes = []
-    texts = []
-    titles = []
-    parsed_descs = []
-
-
-    for i, row in df.iterrows():
-        descs = split_descriptor(row["descriptor"])
-        final_descs = []
-        for desc in descs:
-            final_descriptor = f"#{row["title"]}\n{extract_items(desc)}\n\nPercorso: {row["hierarchy"]}"
-            final_descs.extend(final_descriptor)
-
-        for desc in final_descs:
-            codes.append(row["code"])
-            texts.append(desc)
-            titles.append(row["title"])
-            parsed_descs.append(parse_descriptor(row["descriptor"]))
-    
+
+    items = explode_descriptors(df["descriptor"], lower_items=False, strip_lines=True)
+    rows = df.loc[items.index].reset_index(drop=True)
+
+    texts = expand_template("#{title}\n{content}\n\nPercorso: {hierarchy}", {
+        "title": rows["title"],
+        "content": items.reset_index(drop=True),
+        "hierarchy": rows["hierarchy"],
+    }).tolist()
+    codes = rows["code"].tolist()
+    titles = rows["title"].tolist()
+    parsed_descs = enumerate_descriptors(df["descriptor"]).loc[items.index].tolist()
+
     corpus = build_corpus(
         texts=texts,
         ids=list(range(len(texts))),
@@ -119,14 +119,18 @@ def parse_retrieved(results):
 
 
 class Llama:
-    def __init__(self, model_id: str):
+    def __init__(self, model_id: str, cache_bytes: int = 2 * 1024 ** 3):
+        import torch
+        from transformers import AutoTokenizer, AutoModelForCausalLM
+
         self.tokenizer = AutoTokenizer.from_pretrained(model_id)
         self.model = AutoModelForCausalLM.from_pretrained(
             model_id,
             torch_dtype=torch.bfloat16,
             device_map="auto",
         )
-        self.streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        self.prefix_cache = PrefixCache(max_bytes=cache_bytes)
+        self.last_turn = {}
     
     @staticmethod
     def parse_description(messages: List[str]) -> str:
@@ -139,11 +143,15 @@ class Llama:
         return description
     
     @staticmethod
-    def parse_prompt(system: str, instruction: str) -> str:
-        system_prompt = f"""<|start_header_id|>system<|end_header_id|>
+    def parse_system(system: str) -> str:
+        return f"""<|start_header_id|>system<|end_header_id|>
         {system}
         <|eot_id|>""" if system else ""
 
+    @staticmethod
+    def parse_prompt(system: str, instruction: str) -> str:
+        system_prompt = Llama.parse_system(system)
+
         instruction_prompt = f"""<|start_header_id|>user<|end_header_id|>
         {instruction}<|eot_id|><|start_header_id|>assistant<|end_header_id|>"""
 
@@ -151,9 +159,7 @@ class Llama:
     
     @staticmethod
     def parse_history(system: str, messages: List[str]) -> str:
-        system_prompt = f"""<|start_header_id|>system<|end_header_id|>
-        {system}
-        <|eot_id|>""" if system else ""
+        system_prompt = Llama.parse_system(system)
         
         history = ""
 
@@ -187,27 +193,80 @@ class Llama:
         return self.tokenizer.decode(outputs[0], skip_special_tokens=True).strip()
 
 
-    def stream_with_history(self, system: str, messages: List[str], max_new_tokens: int = 100):
+    def prefill(self, prefix: str):
+        """Compute and pin the past key/values of a shared prompt prefix once."""
+        import torch
+
+        if not prefix or prefix in self.prefix_cache.pinned:
+            return
+        ids = self.tokenizer(prefix, return_tensors="pt")["input_ids"].to(self.model.device)
+        with torch.no_grad():
+            outputs = self.model(input_ids=ids, use_cache=True)
+        self.prefix_cache.pin(prefix, ids[0], outputs.past_key_values)
+
+    def generate_cached(self, prompt: str, streamer, max_new_tokens: int = 100, session_id: str = None, prefix: str = None, **kwargs) -> dict:
+        """`generate` that only prefills the part of `prompt` not already cached
+        for `prefix` (the system prompt) or for the previous turn of `session_id`."""
+        import torch
+
+        self.prefill(prefix)
+        ids = self.tokenizer(prompt, return_tensors="pt")["input_ids"].to(self.model.device)
+        past, reused = self.prefix_cache.match(ids[0], session_id)
+
+        outputs = self.model.generate(
+            input_ids=ids,
+            attention_mask=torch.ones_like(ids),
+            past_key_values=past,
+            streamer=streamer,
+            max_new_tokens=max_new_tokens,
+            return_dict_in_generate=True,
+            **kwargs,
+        )
+
+        if session_id is not None:
+            cache = outputs.past_key_values
+            self.prefix_cache.put(session_id, outputs.sequences[0][:cache.get_seq_length()], cache)
+        self.prefix_cache.record(ids.shape[1], reused)
+        METRICS.inc("llm_prefill_tokens", ids.shape[1] - reused)
+        METRICS.inc("llm_reused_tokens", reused)
+        return {
+            "prompt_tokens": ids.shape[1],
+            "reused_tokens": reused,
+            "prefill_tokens": ids.shape[1] - reused,
+            "new_tokens": outputs.sequences.shape[1] - ids.shape[1],
+        }
+
+    def stream_with_history(self, system: str, messages: List[str], max_new_tokens: int = 100, session_id: str = None):
         prompt = self.parse_history(system, messages)
 
-        inputs = self.tokenizer(
-            prompt,
-            return_tensors="pt"
-        ).to(self.model.device)
+        from transformers import TextIteratorStreamer
 
-        thread = Thread(target=self.model.generate, kwargs={
-            "input_ids": inputs["input_ids"],
-            "streamer": self.streamer,
-            "max_new_tokens": max_new_tokens,
-            "do_sample": True,
-            "top_p": 0.9,
-        })
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        turn = {}
+        thread = Thread(target=lambda: turn.update(self.generate_cached(
+            prompt,
+            streamer,
+            max_new_tokens=max_new_tokens,
+            session_id=session_id,
+            prefix=self.parse_system(system),
+            do_sample=True,
+            top_p=0.9,
+        )))
+        start = time.perf_counter()
         thread.start()
 
-        for chunk in self.streamer:
+        for chunk in streamer:
+            if "time_to_first_token" not in turn:
+                turn["time_to_first_token"] = time.perf_counter() - start
             yield chunk
-        
+
         thread.join()
+        self.last_turn = turn
+        if "time_to_first_token" in turn:
+            METRICS.observe_time("llm_ttft", turn["time_to_first_token"])
+            decode_seconds = time.perf_counter() - start - turn["time_to_first_token"]
+            if decode_seconds > 0 and "new_tokens" in turn:
+                METRICS.observe("llm_tokens_per_second", turn["new_tokens"] / decode_seconds)
 
 
     def stream(self, system: str, instruction: str, max_new_tokens: int = 100):
@@ -218,16 +277,19 @@ class Llama:
             return_tensors="pt"
         ).to(self.model.device)
 
+        from transformers import TextIteratorStreamer
+
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
         thread = Thread(target=self.model.generate, kwargs={
             "input_ids": inputs["input_ids"],
-            "streamer": self.streamer,
+            "streamer": streamer,
             "max_new_tokens": max_new_tokens,
             "do_sample": True,
             "top_p": 0.9,
         })
         thread.start()
 
-        for chunk in self.streamer:
+        for chunk in streamer:
             yield chunk
         
         thread.join()
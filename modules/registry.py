@@ -0,0 +1,88 @@
+import threading
+import weakref
+from typing import Any, Callable, Dict, Hashable
+
+
+class Handle:
+    """A session's reference to a shared registry entry.
+
+    The reference is released on `close()` or when the handle is garbage
+    collected, e.g. together with the Streamlit session state holding it.
+    """
+
+    def __init__(self, registry: "Registry", key: Hashable, value: Any):
+        self.key = key
+        self.value = value
+        self._finalizer = weakref.finalize(self, registry.release, key)
+
+    def close(self):
+        self.value = None
+        self._finalizer()
+
+    @property
+    def closed(self) -> bool:
+        return not self._finalizer.alive
+
+
+class Registry:
+    """Process-wide, reference-counted store of expensive read-only objects.
+
+    The first `acquire` of a key runs its factory, concurrent callers for the
+    same key wait for that build instead of starting their own, and the
+    object is dropped once the last handle is released.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[Hashable, Any] = {}
+        self._refs: Dict[Hashable, int] = {}
+        # key -> [build lock, callers using it]; dropped by the last caller
+        self._building: Dict[Hashable, list] = {}
+
+    def acquire(self, key: Hashable, factory: Callable[[], Any]) -> Handle:
+        with self._lock:
+            building = self._building.setdefault(key, [threading.Lock(), 0])
+            building[1] += 1
+
+        try:
+            with building[0]:
+                with self._lock:
+                    if key in self._values:
+                        self._refs[key] += 1
+                        return Handle(self, key, self._values[key])
+
+                value = factory()
+
+                with self._lock:
+                    self._values[key] = value
+                    self._refs[key] = 1
+                    return Handle(self, key, value)
+        finally:
+            with self._lock:
+                building[1] -= 1
+                if building[1] == 0:
+                    del self._building[key]
+
+    def release(self, key: Hashable):
+        with self._lock:
+            if key not in self._refs:
+                return
+            self._refs[key] -= 1
+            if self._refs[key] <= 0:
+                del self._refs[key]
+                del self._values[key]
+
+    def refcount(self, key: Hashable) -> int:
+        with self._lock:
+            return self._refs.get(key, 0)
+
+    def keys(self):
+        with self._lock:
+            return list(self._values.keys())
+
+
+REGISTRY = Registry()
+
+
+def shared(key: Hashable, factory: Callable[[], Any]) -> Handle:
+    return REGISTRY.acquire(key, factory)
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+from typing import List, Union
+from modules.embeddings import encode
+from modules.metadata import MetadataStore
+from modules.metrics import timed
+
+
+class Hit:
+    """One retrieved chunk; `text` and `metadata` are read from the base
+    only when accessed."""
+
+    __slots__ = ("id", "score", "base")
+
+    def __init__(self, id: int, score: float, base: "VectorKnowledgeBase"):
+        self.id = id
+        self.score = score
+        self.base = base
+
+    @property
+    def text(self) -> str:
+        return self.base.texts[self.id]
+
+    @property
+    def metadata(self):
+        return self.base.metadata[self.id]
+
+    @property
+    def code_id(self) -> int:
+        return int(self.base.code_ids[self.id])
+
+    def __repr__(self):
+        return f"Hit(id={self.id}, score={self.score:.4f}, code={self.metadata.get('code')})"
+
+
+class QueryResult:
+    def __init__(self, query: str, results: List[Hit]):
+        self.query = query
+        self.results = results
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+    def __getitem__(self, idx):
+        return self.results[idx]
+
+
+class VectorKnowledgeBase:
+    """In-memory dense retriever over pre-computed, L2-normalized vectors.
+
+    Exposes the same `search(query, top_k)` interface as
+    `semantic_search.local.LocalKnowledgeBase`, but receives its vectors from
+    the caller so they can come from a cache instead of the encoder.
+
+    `metadata` is a `MetadataStore` (or a plain list with one dict per
+    vector); a store also provides `code_ids`, which map every vector to a
+    row of `code_table`, and `code_table` itself. An approximate `index`
+    (e.g. `modules.ann.IVFIndex`) replaces the exact brute-force scan.
+    """
+
+    def __init__(self, texts: List[str], metadata: Union[MetadataStore, List[dict]], vectors: np.ndarray, model_id: str, batch_size: int = 64,
+                 code_ids: np.ndarray = None, code_table: pd.DataFrame = None, index=None):
+        if isinstance(metadata, MetadataStore):
+            code_ids = metadata.code_ids if code_ids is None else code_ids
+            code_table = metadata.frame if code_table is None else code_table
+        self.texts = texts
+        self.metadata = metadata
+        self.code_ids = code_ids
+        self.code_table = code_table
+        self.index = index
+        self.vectors = vectors
+        self.vectors.setflags(write=False)
+        self.model_id = model_id
+        self.batch_size = batch_size
+
+    def __len__(self):
+        return len(self.texts)
+
+    @timed("embed")
+    def encode(self, queries: List[str]) -> np.ndarray:
+        return encode(queries, self.model_id, self.batch_size)
+
+    def score(self, query_vectors: np.ndarray) -> np.ndarray:
+        return query_vectors @ self.vectors.T
+
+    @timed("search")
+    def search_vectors(self, query_vectors: np.ndarray, top_k: int = 5):
+        if self.index is not None:
+            return self.index.search(self.vectors, query_vectors, top_k)
+
+        scores = self.score(query_vectors)
+        k = min(top_k, scores.shape[1])
+        idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, idx, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        return np.take_along_axis(idx, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    def to_results(self, queries: List[str], idx: np.ndarray, scores: np.ndarray) -> List[QueryResult]:
+        return [
+            QueryResult(q, [Hit(int(i), float(s), self) for i, s in zip(row_idx, row_scores) if np.isfinite(s)])
+            for q, row_idx, row_scores in zip(queries, idx, scores)
+        ]
+
+    def search(self, query: Union[str, List[str]], top_k: int = 5) -> List[QueryResult]:
+        queries = [query] if isinstance(query, str) else list(query)
+        idx, scores = self.search_vectors(self.encode(queries), top_k)
+        return self.to_results(queries, idx, scores)
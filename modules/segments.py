@@ -0,0 +1,441 @@
+"""Append-only delta segments over a `VectorKnowledgeBase`.
+
+    python -m modules.segments data/ateco_2025_leaf.csv \\
+        --augmented data/gpt_augmented_2025.json --model-id BAAI/bge-m3
+
+The base corpus stays immutable. Phrases added later (the synthetic examples
+of `gpt_augmented_2025.json`, user-confirmed queries, codes missing from the
+base) are encoded on their own and written as small delta segments; a search
+scans the base and every segment and merges their top-k. Deleting rows only
+sets tombstones, and `upsert` re-encodes just the phrases that are new for a
+code, so nothing already embedded is embedded again. Once there are more
+than `max_segments` deltas a background thread merges them into one,
+dropping the deleted rows.
+
+Segments and tombstones are stored in `<stem>.<model>.segments/`, next to
+the corpus like the embedding cache, and replayed on start.
+"""
+import os
+import json
+import bisect
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Union
+from modules.embeddings import model_slug
+from modules.metadata import MetadataStore
+from modules.search import QueryResult, VectorKnowledgeBase
+
+BASE_SOURCE = "base"
+
+
+def segments_dir(path: str, model_id: str) -> str:
+    return f"{os.path.splitext(path)[0]}.{model_slug(model_id)}.segments"
+
+
+def _save_npy(path: str, array: np.ndarray):
+    tmp = path + ".tmp.npy"
+    np.save(tmp, array)
+    os.replace(tmp, path)
+
+
+class Segment:
+    """Rows appended together: texts, their codes and source, vectors and an
+    `alive` mask (False marks a tombstone)."""
+
+    def __init__(self, seq: int, texts: List[str], codes: np.ndarray, sources: np.ndarray, vectors: np.ndarray, alive: np.ndarray = None):
+        self.seq = seq
+        self.texts = list(texts)
+        self.codes = np.asarray(codes, dtype=object)
+        self.sources = np.asarray(sources, dtype=object)
+        self.vectors = vectors
+        self.alive = np.ones(len(self.texts), dtype=bool) if alive is None else alive
+
+    def __len__(self):
+        return len(self.texts)
+
+    @property
+    def live(self) -> int:
+        return int(self.alive.sum())
+
+    def paths(self, directory: str):
+        stem = os.path.join(directory, f"segment-{self.seq:06d}")
+        return f"{stem}.npz", f"{stem}.alive.npy"
+
+    def save(self, directory: str):
+        path, _ = self.paths(directory)
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, texts=np.array(self.texts, dtype=str), codes=self.codes.astype(str),
+                 sources=self.sources.astype(str), vectors=np.ascontiguousarray(self.vectors, dtype=np.float32))
+        os.replace(tmp, path)
+        self.save_alive(directory)
+
+    def save_alive(self, directory: str):
+        _save_npy(self.paths(directory)[1], self.alive)
+
+    def remove(self, directory: str):
+        for path in self.paths(directory):
+            if os.path.exists(path):
+                os.remove(path)
+
+    @classmethod
+    def load(cls, directory: str, seq: int) -> "Segment":
+        stem = os.path.join(directory, f"segment-{seq:06d}")
+        with np.load(f"{stem}.npz") as data:
+            segment = cls(seq, data["texts"].tolist(), data["codes"], data["sources"], data["vectors"])
+        if os.path.exists(f"{stem}.alive.npy"):
+            segment.alive = np.load(f"{stem}.alive.npy")
+        return segment
+
+
+class ConcatTexts:
+    """The texts of the base and of every segment, indexed by global row."""
+
+    def __init__(self, parts: List, offsets: List[int]):
+        self.parts = parts
+        self.offsets = offsets
+
+    def __len__(self):
+        return self.offsets[-1] + len(self.parts[-1]) if self.parts else 0
+
+    def __getitem__(self, i: int) -> str:
+        part = bisect.bisect_right(self.offsets, i) - 1
+        return self.parts[part][i - self.offsets[part]]
+
+    def tolist(self) -> List[str]:
+        return [t for part in self.parts for t in part]
+
+
+class SegmentView:
+    """Immutable snapshot of the base, the segments and their tombstones.
+
+    Global row ids number the base rows first, then the rows of each segment
+    in order; `code_ids` and `metadata` are indexed by them.
+    """
+
+    def __init__(self, base: VectorKnowledgeBase, base_alive: np.ndarray, segments: tuple, code_table: pd.DataFrame,
+                 code_index: Dict[str, int], version: int):
+        self.base = base
+        self.base_alive = base_alive
+        self.segments = segments
+        self.version = version
+        self.offsets = list(np.cumsum([len(base)] + [len(s) for s in segments[:-1]])) if segments else []
+        self.code_ids = np.concatenate(
+            [np.asarray(base.code_ids, dtype=np.int32)] + [np.array([code_index[c] for c in s.codes], dtype=np.int32) for s in segments]
+        )
+        self.metadata = MetadataStore(self.code_ids, code_table)
+        self.texts = ConcatTexts([base.texts] + [s.texts for s in segments], [0] + self.offsets)
+
+    def search_vectors(self, query_vectors: np.ndarray, top_k: int = 5):
+        view = self
+        # over-fetch from the base by the number of its tombstones
+        base_k = min(top_k + int((~view.base_alive).sum()), len(self.base))
+        idx, scores = self.base.search_vectors(query_vectors, base_k)
+        parts_idx, parts_scores = [idx], [np.where(view.base_alive[idx], scores, -np.inf)]
+
+        for segment, offset in zip(view.segments, view.offsets):
+            seg_scores = query_vectors @ segment.vectors.T
+            seg_scores[:, ~segment.alive] = -np.inf
+            k = min(top_k, len(segment))
+            seg_idx = np.argpartition(-seg_scores, k - 1, axis=1)[:, :k]
+            parts_idx.append(seg_idx + offset)
+            parts_scores.append(np.take_along_axis(seg_scores, seg_idx, axis=1))
+
+        idx, scores = np.concatenate(parts_idx, axis=1), np.concatenate(parts_scores, axis=1)
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :top_k]
+        return np.take_along_axis(idx, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+    def to_results(self, queries: List[str], idx: np.ndarray, scores: np.ndarray) -> List[QueryResult]:
+        """Hits bound to this view, so they keep resolving to the rows they
+        were found at after a merge renumbers them."""
+        return VectorKnowledgeBase.to_results(self, queries, idx, scores)
+
+
+class SegmentedKnowledgeBase:
+    """A `VectorKnowledgeBase` plus append-only delta segments.
+
+    Writers (`append`, `delete`, `upsert`, `merge`) serialize on a lock and
+    publish a new `SegmentView`; searches read whichever view is current, so
+    they never wait for a write or a merge. `version` changes with every
+    write, e.g. for `CachedKnowledgeBase` to drop stale results.
+    """
+
+    def __init__(self, base: VectorKnowledgeBase, directory: str = None, max_segments: int = 4, background_merge: bool = True):
+        if base.code_ids is None:
+            raise ValueError("The base needs code_ids and a code_table")
+        self.base = base
+        self.model_id = base.model_id
+        self.batch_size = base.batch_size
+        self.directory = directory
+        self.max_segments = max_segments
+        self.background_merge = background_merge
+        self.merges = 0
+        self._lock = threading.RLock()
+        self._merger = None
+
+        code_table = base.code_table.reset_index(drop=True)
+        segments, base_alive, next_seq = [], np.ones(len(base), dtype=bool), 1
+        if directory is not None:
+            segments, base_alive, code_table, next_seq = self._load(code_table, base_alive)
+        self._next_seq = next_seq
+        self._publish(tuple(segments), base_alive, code_table)
+
+    def _load(self, code_table: pd.DataFrame, base_alive: np.ndarray):
+        os.makedirs(self.directory, exist_ok=True)
+        manifest_path = os.path.join(self.directory, "manifest.json")
+        manifest = {"model_id": self.model_id, "base_rows": len(self.base)}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r") as f:
+                stored = json.load(f)
+            if stored != manifest:
+                raise ValueError(f"{self.directory} was written for {stored}, not {manifest}")
+        else:
+            with open(manifest_path, "w") as f:
+                json.dump(manifest, f)
+
+        codes_path = os.path.join(self.directory, "codes.json")
+        if os.path.exists(codes_path):
+            with open(codes_path, "r") as f:
+                extra = pd.DataFrame(json.load(f), columns=code_table.columns).fillna("")
+            code_table = pd.concat([code_table, extra], ignore_index=True)
+
+        alive_path = os.path.join(self.directory, "base.alive.npy")
+        if os.path.exists(alive_path):
+            base_alive = np.load(alive_path)
+
+        seqs = sorted(int(name[len("segment-"):-len(".npz")]) for name in os.listdir(self.directory)
+                      if name.startswith("segment-") and name.endswith(".npz") and not name.endswith(".tmp.npz"))
+        segments = [Segment.load(self.directory, seq) for seq in seqs]
+        return segments, base_alive, code_table, (seqs[-1] + 1 if seqs else 1)
+
+    def _publish(self, segments: tuple, base_alive: np.ndarray, code_table: pd.DataFrame):
+        code_index = {c: i for i, c in enumerate(code_table["code"])}
+        version = self.view.version + 1 if hasattr(self, "view") else 0
+        self.view = SegmentView(self.base, base_alive, segments, code_table, code_index, version)
+
+    def __len__(self):
+        return len(self.view.code_ids)
+
+    @property
+    def version(self) -> int:
+        return self.view.version
+
+    @property
+    def texts(self) -> ConcatTexts:
+        return self.view.texts
+
+    @property
+    def metadata(self) -> MetadataStore:
+        return self.view.metadata
+
+    @property
+    def code_ids(self) -> np.ndarray:
+        return self.view.code_ids
+
+    @property
+    def code_table(self) -> pd.DataFrame:
+        return self.view.metadata.frame
+
+    @property
+    def vectors(self) -> np.ndarray:
+        view = self.view
+        return np.concatenate([self.base.vectors] + [s.vectors for s in view.segments])
+
+    def encode(self, queries: List[str]) -> np.ndarray:
+        return self.base.encode(queries)
+
+    def snapshot(self) -> SegmentView:
+        """The current view; search with it to resolve hits against the same
+        rows however many writes or merges happen meanwhile."""
+        return self.view
+
+    def search_vectors(self, query_vectors: np.ndarray, top_k: int = 5):
+        return self.view.search_vectors(query_vectors, top_k)
+
+    def to_results(self, queries: List[str], idx: np.ndarray, scores: np.ndarray) -> List[QueryResult]:
+        return self.view.to_results(queries, idx, scores)
+
+    def search(self, query: Union[str, List[str]], top_k: int = 5) -> List[QueryResult]:
+        queries = [query] if isinstance(query, str) else list(query)
+        view = self.view
+        idx, scores = view.search_vectors(self.encode(queries), top_k)
+        return view.to_results(queries, idx, scores)
+
+    def _code_table_with(self, codes, fields: Dict[str, dict]) -> pd.DataFrame:
+        code_table = self.view.metadata.frame
+        known = set(code_table["code"])
+        new = [c for c in dict.fromkeys(codes) if c not in known]
+        if not new:
+            return code_table
+        fields = fields or {}
+        rows = pd.DataFrame([{"code": c, **fields.get(c, {})} for c in new], columns=code_table.columns).fillna("")
+        if self.directory is not None:
+            codes_path = os.path.join(self.directory, "codes.json")
+            stored = json.load(open(codes_path, "r")) if os.path.exists(codes_path) else []
+            with open(codes_path + ".tmp", "w") as f:
+                json.dump(stored + rows.to_dict("records"), f, ensure_ascii=False)
+            os.replace(codes_path + ".tmp", codes_path)
+        return pd.concat([code_table, rows], ignore_index=True)
+
+    def append(self, codes: List[str], texts: List[str], source: str = "augmented", fields: Dict[str, dict] = None) -> Segment:
+        """Encodes `texts` (one per entry of `codes`) into a new segment.
+        Codes missing from the code table are added, with `fields[code]` as
+        their metadata."""
+        if source == BASE_SOURCE:
+            raise ValueError(f"'{BASE_SOURCE}' is reserved for the base corpus")
+        vectors = self.base.encode(list(texts)) if len(texts) else None
+        with self._lock:
+            if not len(texts):
+                return None
+            code_table = self._code_table_with(codes, fields)
+            segment = Segment(self._next_seq, texts, codes, [source] * len(texts), vectors)
+            self._next_seq += 1
+            if self.directory is not None:
+                segment.save(self.directory)
+            view = self.view
+            self._publish(view.segments + (segment,), view.base_alive, code_table)
+        self._maybe_merge()
+        return segment
+
+    def delete(self, codes: List[str], source: str = None) -> int:
+        """Tombstones every row of `codes`, or only those from `source`."""
+        codes = set([codes] if isinstance(codes, str) else codes)
+        with self._lock:
+            view = self.view
+            deleted = 0
+            base_alive = view.base_alive
+            if source in (None, BASE_SOURCE):
+                code_ids = [i for i, c in enumerate(view.metadata.frame["code"]) if c in codes]
+                hit = base_alive & np.isin(self.base.code_ids, code_ids)
+                if hit.any():
+                    base_alive = base_alive & ~hit
+                    deleted += int(hit.sum())
+                    if self.directory is not None:
+                        _save_npy(os.path.join(self.directory, "base.alive.npy"), base_alive)
+
+            segments = []
+            for segment in view.segments:
+                hit = segment.alive & np.isin(segment.codes, list(codes))
+                if source is not None:
+                    hit &= segment.sources == source
+                if hit.any():
+                    segment = Segment(segment.seq, segment.texts, segment.codes, segment.sources, segment.vectors, segment.alive & ~hit)
+                    deleted += int(hit.sum())
+                    if self.directory is not None:
+                        segment.save_alive(self.directory)
+                segments.append(segment)
+
+            if deleted:
+                self._publish(tuple(segments), base_alive, view.metadata.frame)
+            return deleted
+
+    def upsert(self, phrases: Dict[str, List[str]], source: str = "augmented", fields: Dict[str, dict] = None) -> dict:
+        """Makes `phrases[code]` the live `source` rows of each code: rows
+        whose text is no longer listed are tombstoned and only texts not yet
+        live are encoded."""
+        with self._lock:
+            view = self.view
+            listed = {code: set(texts) for code, texts in phrases.items()}
+            live, segments, deleted = {}, [], 0
+            for segment in view.segments:
+                rows = segment.alive & (segment.sources == source)
+                stale = rows & np.array([c in listed and t not in listed[c] for c, t in zip(segment.codes, segment.texts)], dtype=bool)
+                for r in np.flatnonzero(rows & ~stale):
+                    live.setdefault(segment.codes[r], set()).add(segment.texts[r])
+                if stale.any():
+                    segment = Segment(segment.seq, segment.texts, segment.codes, segment.sources, segment.vectors, segment.alive & ~stale)
+                    deleted += int(stale.sum())
+                    if self.directory is not None:
+                        segment.save_alive(self.directory)
+                segments.append(segment)
+            if deleted:
+                self._publish(tuple(segments), view.base_alive, view.metadata.frame)
+
+            new = [(code, text) for code, texts in phrases.items() for text in dict.fromkeys(texts) if text not in live.get(code, ())]
+        # encoding happens in append, outside the lock
+        self.append([c for c, _ in new], [t for _, t in new], source=source, fields=fields)
+        return {"deleted": deleted, "added": len(new)}
+
+    def _maybe_merge(self):
+        if len(self.view.segments) <= self.max_segments:
+            return
+        if not self.background_merge:
+            self.merge()
+        elif self._merger is None or not self._merger.is_alive():
+            self._merger = threading.Thread(target=self.merge, name="segment-merge", daemon=True)
+            self._merger.start()
+
+    def merge(self) -> Segment:
+        """Folds every delta segment into one, dropping tombstoned rows.
+
+        The new segment is built from a snapshot without holding the lock;
+        tombstones set meanwhile are carried over when it is published, and
+        segments appended meanwhile are kept after it.
+        """
+        merged_from = self.view.segments
+        if len(merged_from) < 2:
+            return None
+        rows = [np.flatnonzero(s.alive) for s in merged_from]
+        texts = [s.texts[r] for s, idx in zip(merged_from, rows) for r in idx]
+        codes = np.concatenate([s.codes[idx] for s, idx in zip(merged_from, rows)])
+        sources = np.concatenate([s.sources[idx] for s, idx in zip(merged_from, rows)])
+        vectors = np.concatenate([s.vectors[idx] for s, idx in zip(merged_from, rows)])
+
+        with self._lock:
+            view = self.view
+            if tuple(s.seq for s in view.segments[:len(merged_from)]) != tuple(s.seq for s in merged_from):
+                return None  # another merge folded these segments first
+            current = {s.seq: s for s in view.segments}
+            alive = np.concatenate([current[s.seq].alive[idx] for s, idx in zip(merged_from, rows)])
+            merged = Segment(merged_from[-1].seq, texts, codes, sources, vectors, alive)
+            if self.directory is not None:
+                merged.save(self.directory)
+                for s in merged_from[:-1]:
+                    s.remove(self.directory)
+            later = tuple(s for s in view.segments if s.seq > merged.seq)
+            self._publish((merged,) + later, view.base_alive, view.metadata.frame)
+            self.merges += 1
+        return merged
+
+    def stats(self) -> dict:
+        view = self.view
+        return {
+            "segments": len(view.segments),
+            "segment_rows": sum(len(s) for s in view.segments),
+            "tombstones": int((~view.base_alive).sum()) + sum(len(s) - s.live for s in view.segments),
+            "merges": self.merges,
+            "version": view.version,
+        }
+
+
+def load_augmented(path: str) -> Dict[str, List[str]]:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def main():
+    from modules.knowledge_base import get_base
+
+    parser = argparse.ArgumentParser(description="Add phrases to the delta segments of a leaf corpus")
+    parser.add_argument("path", help="leaf CSV (or its .artifact)")
+    parser.add_argument("--model-id", default="BAAI/bge-m3")
+    parser.add_argument("--augmented", default=None, help="JSON of {code: [phrases]} to upsert")
+    parser.add_argument("--source", default="augmented")
+    parser.add_argument("--delete", nargs="*", default=[], help="codes whose rows to delete")
+    parser.add_argument("--merge", action="store_true", help="merge all segments before exiting")
+    args = parser.parse_args()
+
+    base = get_base(path=args.path, model_id=args.model_id)
+    kb = SegmentedKnowledgeBase(base, segments_dir(args.path, args.model_id), background_merge=False)
+    if args.augmented:
+        print(kb.upsert(load_augmented(args.augmented), source=args.source))
+    if args.delete:
+        print({"deleted": kb.delete(args.delete, source=args.source)})
+    if args.merge:
+        kb.merge()
+    print(kb.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+from typing import List
+from modules.knowledge_base import parse_retrieved_batch
+from modules.search import QueryResult
+
+
+class RetrievalSession:
+    """Retrieval state of one conversation.
+
+    Every user turn is encoded once; the session keeps an exponentially
+    decayed sum of the turn vectors (the latest turn has weight 1, the one
+    before `decay`, then `decay ** 2`, ...) and searches with its normalized
+    direction. Since scores are inner products, this is the same as fusing the
+    per-turn scores with those weights, but costs one encode and one scan per
+    turn however long the conversation gets.
+    """
+
+    def __init__(self, base, decay: float = 0.8):
+        self.base = base
+        self.decay = decay
+        self.queries = []
+        self.pooled = None
+
+    def __len__(self):
+        return len(self.queries)
+
+    def add(self, query: str) -> np.ndarray:
+        vector = self.base.encode([query])[0]
+        self.pooled = vector if self.pooled is None else self.decay * self.pooled + vector
+        self.queries.append(query)
+        return vector
+
+    def query_vector(self) -> np.ndarray:
+        return self.pooled / max(np.linalg.norm(self.pooled), 1e-12)
+
+    def search(self, query: str, top_k: int = 5) -> List[QueryResult]:
+        """Adds `query` as the next turn and searches with the whole conversation."""
+        self.add(query)
+        view = self.base.snapshot() if hasattr(self.base, "snapshot") else self.base
+        idx, scores = view.search_vectors(self.query_vector()[None, :], top_k)
+        return view.to_results([". ".join(self.queries)], np.maximum(idx, 0), scores)
+
+    def search_codes(self, query: str, top_k: int = 5, search_k: int = None) -> pd.DataFrame:
+        """Like `search`, but the `top_k` distinct codes (best chunk score
+        per code) among `search_k` chunk hits (default `10 * top_k`), in
+        rank order, as the DataFrame of `parse_retrieved`."""
+        results = self.search(query, top_k=search_k or 10 * top_k)
+        return parse_retrieved_batch(results, self.base, top_k=top_k, as_frame=True)[0]
+
+    def reset(self):
+        self.queries = []
+        self.pooled = None
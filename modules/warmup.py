@@ -0,0 +1,51 @@
+import time
+import threading
+from typing import Any, Callable
+from modules.metrics import METRICS
+
+
+class Warmup:
+    """Builds a value in a background thread while the app renders.
+
+    `factory(progress)` runs in a daemon thread and reports with
+    `progress(fraction, message)`; `result()` blocks only if the value is not
+    ready yet and re-raises the factory's exception, if any.
+    """
+
+    def __init__(self, factory: Callable[[Callable[[float, str], None]], Any], name: str = "warmup"):
+        self.name = name
+        self.fraction = 0.0
+        self.message = ""
+        self.value = None
+        self.error = None
+        self.seconds = None
+        self.ready = threading.Event()
+        self.started = time.perf_counter()
+        self.thread = threading.Thread(target=self._run, args=(factory,), name=name, daemon=True)
+        self.thread.start()
+
+    def progress(self, fraction: float, message: str):
+        self.fraction = min(max(fraction, 0.0), 1.0)
+        self.message = message
+
+    def _run(self, factory):
+        try:
+            self.value = factory(self.progress)
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.seconds = time.perf_counter() - self.started
+            self.fraction = 1.0
+            METRICS.observe_time(self.name, self.seconds)
+            self.ready.set()
+
+    @property
+    def done(self) -> bool:
+        return self.ready.is_set()
+
+    def result(self, timeout: float = None):
+        if not self.ready.wait(timeout):
+            raise TimeoutError(f"{self.name} did not finish in {timeout} s")
+        if self.error is not None:
+            raise self.error
+        return self.value
@@ -0,0 +1,42 @@
+import json
+import asyncio
+from aiohttp import web
+from modules.circe import ERROR, harvest_async, load_results, export_results
+
+
+async def circe_stub(request):
+    form = await request.post()
+    body = {"0": [{"ateco_code": "01.11.00", "ateco_description": form["search"]}]}
+    return web.Response(text=json.dumps(body))
+
+
+async def run_harvest(queries, checkpoint):
+    app = web.Application()
+    app.router.add_post("/", circe_stub)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        return await harvest_async(queries, checkpoint, url=f"http://127.0.0.1:{port}/", concurrency=2, rate=None, retries=0)
+    finally:
+        await runner.cleanup()
+
+
+def test_resume_after_torn_line(tmp_path):
+    checkpoint = tmp_path / "circe.jsonl"
+    queries = ["vini", "scenografi", "riso", "panetteria"]
+    first = {"idx": 0, "query": "vini", "result": {"0": {"code": "11.02.10", "desc": "vini"}}}
+    checkpoint.write_text(json.dumps(first) + "\n" + '{"idx": 3, "que')
+
+    stats = asyncio.run(run_harvest(queries, str(checkpoint)))
+
+    assert stats["skipped"] == 1 and stats["done"] == 3 and stats["errors"] == 0
+    for line in checkpoint.read_text().splitlines():
+        json.loads(line)
+    results = load_results(str(checkpoint))
+    assert list(results) == ["0", "1", "2", "3"]
+    assert results["0"]["result"]["0"]["code"] == "11.02.10"
+    assert all(r["result"] != ERROR for r in results.values())
+    assert export_results(str(checkpoint), str(tmp_path / "circe.json")) == results
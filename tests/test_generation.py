@@ -0,0 +1,83 @@
+import time
+import queue
+import numpy as np
+import pytest
+from modules.generation import GenerationScheduler
+
+pytest.importorskip("transformers")
+
+
+class StubTokenizer:
+    eos_token_id = 0
+    eos_token = "<eos>"
+    pad_token = "<pad>"
+    pad_token_id = 0
+    padding_side = "right"
+
+    def get_vocab(self):
+        return {}
+
+    def convert_tokens_to_ids(self, token):
+        return None
+
+    def decode(self, ids, skip_special_tokens=True):
+        return " ".join(map(str, ids))
+
+
+class StubLlama:
+    """Streams `max_new_tokens` tokens; the first call has a slow prefill."""
+
+    tokenizer = StubTokenizer()
+    model = None
+
+    def __init__(self, cold_prefill: float, token_seconds: float = 0.001):
+        self.cold_prefill = cold_prefill
+        self.token_seconds = token_seconds
+        self.calls = 0
+
+    def generate_cached(self, prompt, streamer, max_new_tokens, **kwargs):
+        self.calls += 1
+        streamer.put(np.zeros((1, 3)))
+        time.sleep(self.cold_prefill if self.calls == 1 else 0.0)
+        for token in range(1, max_new_tokens + 1):
+            streamer.put(np.array([[token]]))
+            time.sleep(self.token_seconds)
+        return {}
+
+
+def wait_for_stats(scheduler, requests: int):
+    # a stream ends at its last token, the worker records the batch just after
+    deadline = time.perf_counter() + 5
+    while scheduler.throughput()["requests"] < requests and time.perf_counter() < deadline:
+        time.sleep(0.01)
+
+
+def test_slow_cold_prefill_does_not_block_admission():
+    scheduler = GenerationScheduler(StubLlama(cold_prefill=0.3), max_batch_size=1, ttft_target=0.1)
+    assert "".join(scheduler.submit("cold", 3))
+    wait_for_stats(scheduler, 1)
+
+    # idle again: every later request is admitted and answered
+    for _ in range(3):
+        assert "".join(scheduler.submit("warm", 3))
+    wait_for_stats(scheduler, 4)
+    assert scheduler.throughput()["rejected"] == 0
+    assert scheduler.expected_wait() == 0.0
+
+
+def test_rejects_when_the_queue_wait_exceeds_the_target():
+    scheduler = GenerationScheduler(StubLlama(cold_prefill=0.0, token_seconds=0.01), max_batch_size=1, ttft_target=0.2)
+    "".join(scheduler.submit("timing", 5))
+    wait_for_stats(scheduler, 1)
+
+    admitted, rejected = [], 0
+    for _ in range(10):
+        try:
+            admitted.append(scheduler.submit("burst", 10))
+        except queue.Full:
+            rejected += 1
+    for request in admitted:
+        "".join(request)
+
+    assert rejected > 0 and admitted
+    assert max(r.time_to_first_token for r in admitted) < 0.2 + 0.1
@@ -0,0 +1,34 @@
+import numpy as np
+from modules.query_cache import CachedKnowledgeBase, normalize_query
+
+
+class StubBase:
+    """Encodes each text to a vector derived from its characters and records what it saw."""
+
+    model_id = "stub"
+
+    def __init__(self):
+        self.seen = []
+
+    def encode(self, queries):
+        self.seen.extend(queries)
+        return np.array([[sum(map(ord, q)), len(q)] for q in queries], dtype=np.float32)
+
+
+def test_variants_share_an_embedding_whatever_arrives_first():
+    vectors = []
+    for order in (["Attività Agricola", "attivita  agricola"], ["attivita  agricola", "Attività Agricola"]):
+        base = StubBase()
+        cached = CachedKnowledgeBase(base)
+        first = cached.encode(order[:1])
+        second = cached.encode(order[1:])
+        np.testing.assert_array_equal(first, second)
+        assert base.seen == ["attivita agricola"]
+        vectors.append(first)
+    np.testing.assert_array_equal(*vectors)
+
+
+def test_normalize_query_is_idempotent():
+    for query in ["Attività  Agricola!", "aaagente di commercio", "VENDITA_vini", "  ccommercio  "]:
+        canonical = normalize_query(query)
+        assert normalize_query(canonical) == canonical